@@ -1,4 +1,3 @@
-import librosa
 import numpy as np
 import pickle
 import json
@@ -7,13 +6,14 @@ import os
 from zipfile import ZipFile
 from collections import Counter
 import shutil
-import nltk
-from nltk.corpus import wordnet
-from nltk.probability import FreqDist
 import random
-from nltk.corpus import wordnet
 import csv
 
+import takefile
+
+# librosa, nltk, scipy and matplotlib/pylab take seconds to import, so they are
+# imported inside the functions that need them rather than at startup.
+
 
 class Utils:
 
@@ -39,26 +39,6 @@ class Utils:
     def has_file_ext(file_name, ext="zip"):
         return file_name.endswith(ext)
 
-    def zip_files(file_paths, zip_dest_path, append_name=""):
-        zip_name = os.path.splitext(zip_dest_path)[0]
-        list1 = zip_name.lower().split("_" + Configs.TRAINING_MODEL.lower())
-        list2 = zip_name.lower().split("_v".lower())
-        zip_dest_path = list1[0] + append_name + "_v" + list2[1] + ".zip"
-        zip_name = zip_dest_path.split("/")[-1]
-
-        with ZipFile(zip_dest_path, "w") as zip_object:
-            # Adding files that need to be zipped
-            for file_path in file_paths:
-                zip_object.write(file_path)
-
-        return zip_name, zip_dest_path
-
-        # Check to see if the zip file is created
-        if os.path.exists(zip_dest_path):
-            print("ZIP file created")
-        else:
-            print("ZIP file not created")
-
     def unzip_files(zip_file_path, unzip_dest_path=None):
         zip_file_path = os.path.splitext(zip_file_path)[0] + ".zip"
 
@@ -142,26 +122,24 @@ class Utils:
             return list
 
     def load_wav_file(_wav_file_="test.wav"):
+        import librosa
+
         return librosa.load(_wav_file_, sr=None, mono=True, dtype=np.float32)
 
     def spectogram_librosa(_wav_file_="test.wav"):
         import pylab
 
-        (sig, rate) = librosa.load(_wav_file_, sr=None, mono=True, dtype=np.float32)
-        pylab.specgram(sig, Fs=rate)
+        wav = takefile.open_map(_wav_file_)
+        pylab.specgram(wav.as_float(wav[:]), Fs=wav.sample_rate)
         pylab.savefig("./output/spectrogram3.png")
 
     def graph_spectrogram_wave(wav_file):
-        import wave
         import pylab
 
         def get_wav_info(wav_file):
-            wav = wave.open(wav_file, "r")
-            frames = wav.readframes(-1)
-            sound_info = pylab.fromstring(frames, "int16")
-            frame_rate = wav.getframerate()
-            wav.close()
-            return sound_info, frame_rate
+            wav = takefile.open_map(wav_file)
+            # Memory-mapped, pages are read as specgram walks through them
+            return wav[:], wav.sample_rate
 
         sound_info, frame_rate = get_wav_info(wav_file)
         pylab.figure(num=3, figsize=(10, 6))
@@ -171,20 +149,69 @@ class Utils:
 
     def graph_wavfileread(_wav_file_):
         import matplotlib.pyplot as plt
-        from scipy import signal
-        from scipy.io import wavfile
-        import numpy as np
 
-        sample_rate, samples = wavfile.read(_wav_file_)
-        frequencies, times, spectrogram = signal.spectrogram(
-            samples, sample_rate, nfft=1024
+        frequencies, times, spectrogram = Utils.spectrogram_chunked(
+            _wav_file_, nfft=1024
         )
         plt.pcolormesh(times, frequencies, 10 * np.log10(spectrogram))
         plt.ylabel("Frequency [Hz]")
         plt.xlabel("Time [sec]")
         plt.savefig("spectogram1.png")
 
+    def spectrogram_chunked(
+        _wav_file_, nperseg=256, noverlap=None, nfft=None, chunk_s=30
+    ):
+        """`scipy.signal.spectrogram` of a WAV, computed `chunk_s` seconds at a time from a memory map.
+        Gives the same segments as one call over the whole file. Returns (frequencies, times, power).
+        """
+        from scipy import signal
+
+        wav = takefile.open_map(_wav_file_)
+        if noverlap is None:
+            noverlap = nperseg // 8
+        if len(wav) < nperseg:
+            # Shorter than one segment: a single call, which shrinks the segment to the clip as before
+            if not len(wav):
+                return np.zeros(0), np.zeros(0), np.zeros((0, 0))
+            return signal.spectrogram(
+                wav[:], wav.sample_rate, nperseg=nperseg, nfft=nfft
+            )
+        hop = nperseg - noverlap
+        # Chunks overlap by noverlap and start on a segment boundary
+        segments = max(1, int(chunk_s * wav.sample_rate) // hop)
+        frequencies, times, powers = None, [], []
+        for start, frames in wav.chunks(segments * hop + noverlap, overlap=noverlap):
+            if len(frames) < nperseg:
+                break
+            frequencies, t, power = signal.spectrogram(
+                frames, wav.sample_rate, nperseg=nperseg, noverlap=noverlap, nfft=nfft
+            )
+            times.append(t + start / float(wav.sample_rate))
+            powers.append(power)
+        return frequencies, np.concatenate(times), np.concatenate(powers, axis=-1)
+
+    def wav_statistics(_wav_file_, chunk_s=30):
+        """Duration, peak, RMS and clipped sample count of a WAV, streamed in `chunk_s` blocks from a memory map."""
+        wav = takefile.open_map(_wav_file_)
+        peak, sum_squares, clipped = 0.0, 0.0, 0
+        for start, frames in wav.chunks(int(chunk_s * wav.sample_rate)):
+            frames = np.abs(wav.as_float(frames))
+            if len(frames):
+                peak = max(peak, float(frames.max()))
+            flat = frames.ravel().astype(np.float64)
+            sum_squares += float(np.dot(flat, flat))
+            clipped += int(np.count_nonzero(frames >= 0.999))
+        samples = len(wav) * wav.channels
+        return {
+            "duration": wav.duration,
+            "peak": peak,
+            "rms": math.sqrt(sum_squares / samples) if samples else 0.0,
+            "clipped": clipped,
+        }
+
     def download_dataset():
+        import nltk
+        from nltk.probability import FreqDist
 
         # Download the WordNet database if not already downloaded
         nltk.download("wordnet")
@@ -273,7 +300,7 @@ class Utils:
             file.close()
 
 
-Utils.load_wav_file()
+# Utils.load_wav_file()
 # Utils.download_dataset()
 # Utils.generate_medicine_names()
 
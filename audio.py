@@ -1,4 +1,4 @@
-import collections, wave, logging, os, datetime
+import collections, wave, logging, os, datetime, threading, time
 import pyaudio
 import webrtcvad
 
@@ -8,37 +8,200 @@ except ImportError:
     # python 2
     import Queue as queue
 
+import takefile
+from takefile import write_wav
+
+
+class PyAudioSource(object):
+    """The default input of `Audio`: a live PyAudio stream from the default microphone.
+        A source is opened with `open(rate, channels, block_size, callback)`, then `start()`ed and finally `close()`d;
+        it calls `callback(in_data, frame_count, time_info, status)` with each block, like a PyAudio stream callback.
+    """
+
+    def open(self, rate, channels, block_size, callback):
+        self.pa = pyaudio.PyAudio()
+        self.stream = self.pa.open(format=Audio.FORMAT,
+                                   channels=channels,
+                                   rate=rate,
+                                   input=True,
+                                   frames_per_buffer=block_size,
+                                   stream_callback=callback)
+
+    def start(self):
+        self.stream.start_stream()
+
+    def close(self):
+        self.stream.stop_stream()
+        self.stream.close()
+        self.pa.terminate()
+
+
+class ArraySource(object):
+    """Virtual input playing int16 mono audio (bytes, an int16 array, or a take filename in any codec) through the
+        same callback as a microphone, so the capture pipeline can run without a sound card.
+        With `paced=True` a thread delivers one block per block duration, like a live stream. Otherwise nothing is
+        delivered until `pump()` is called, which passes blocks to the callback on the caller's thread as fast as it
+        can. With `loop=True` the audio repeats forever; otherwise the source goes quiet at its end.
+    """
+
+    def __init__(self, data, paced=False, loop=False):
+        sample_rate = None
+        if isinstance(data, str):
+            pcm, sample_rate = takefile.read(data)
+            data = pcm.tobytes()
+        self.data = memoryview(data).cast('B')
+        self.sample_rate = sample_rate
+        self.paced = paced
+        self.loop = loop
+        self.position = 0
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def open(self, rate, channels, block_size, callback):
+        if channels != 1 or (self.sample_rate and self.sample_rate != rate):
+            raise Exception("source audio is %s Hz mono, the stream is %s Hz with %s channels" % (self.sample_rate, rate, channels))
+        self.rate = rate
+        self.block_size = block_size
+        self.block_bytes = 2 * block_size
+        self.callback = callback
+
+    def start(self):
+        if self.paced:
+            self.thread = threading.Thread(target=self._run_paced, name='array-source', daemon=True)
+            self.thread.start()
+
+    def _next_block(self):
+        if self.position + self.block_bytes > len(self.data):
+            if not self.loop or len(self.data) < self.block_bytes:
+                return None
+            self.position = 0
+        block = bytes(self.data[self.position:self.position + self.block_bytes])
+        self.position += self.block_bytes
+        return block
+
+    def _deliver(self, block):
+        now = time.perf_counter()
+        self.callback(block, self.block_size, {'current_time': now, 'input_buffer_adc_time': now}, 0)
+
+    def pump(self, blocks=None, seconds=None):
+        """Deliver `blocks` blocks (or `seconds` of audio; by default all that is left) right away. Returns how many were delivered."""
+        if seconds is not None:
+            blocks = int(round(seconds * self.rate / self.block_size))
+        elif blocks is None:
+            blocks = (len(self.data) - self.position) // self.block_bytes
+        delivered = 0
+        while delivered < blocks:
+            block = self._next_block()
+            if block is None:
+                break
+            self._deliver(block)
+            delivered += 1
+        return delivered
+
+    def _run_paced(self):
+        block_s = self.block_size / float(self.rate)
+        next_time = time.perf_counter()
+        while not self.stopped.is_set():
+            block = self._next_block()
+            if block is None:
+                return
+            next_time += block_s
+            self.stopped.wait(max(0, next_time - time.perf_counter()))
+            self._deliver(block)
+
+    def close(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
 
 class Audio(object):
-    """Streams raw audio from microphone. Data is received in a separate thread, and stored in a buffer, to be read from."""
+    """Streams raw audio from microphone. Data is received in a separate thread, and stored in a buffer, to be read from.
+        With `gated=True` the stream is opened once and left running: blocks go to `callback` only while the gate is
+        open (between `open_gate()` and `close_gate()`), and to `idle_callback` (or nowhere) otherwise.
+        Blocks come from `source`, the microphone through PyAudio by default (see `PyAudioSource` and `ArraySource`).
+        With a `telemetry.Telemetry`, every block records the callback's duration and jitter and input overflows, and
+        blocks discarded with the gate closed and no `idle_callback` are counted. Without a `callback`, the read queue's
+        depth and the blocks dropped because it is full are recorded too.
+    """
 
     FORMAT = pyaudio.paInt16
     RATE = 16000
     CHANNELS = 1
     BLOCKS_PER_SECOND = 50
 
-    def __init__(self, callback=None, buffer_s=0, flush_queue=True):
+    def __init__(self, callback=None, buffer_s=0, flush_queue=True, gated=False, idle_callback=None, latency_callback=None, source=None, telemetry=None):
         def proxy_callback(in_data, frame_count, time_info, status):
-            callback(in_data)
+            started_at = time.perf_counter() if self.telemetry else None
+            with self.gate_lock:
+                if self.gate:
+                    if self.gate_opened_at is not None:
+                        self._report_latency(time_info)
+                    callback(in_data)
+                elif idle_callback:
+                    idle_callback(in_data)
+                elif started_at is not None:
+                    self.telemetry.count('capture.discarded_blocks')
+            if started_at is not None: self._report_block(started_at, status)
             return (None, pyaudio.paContinue)
-        if callback is None: callback = lambda in_data: self.buffer_queue.put(in_data, block=False)
+        if callback is None: callback = self._queue_block
+        self.telemetry = telemetry
+        self.last_block_at = None
+        self.gate = not gated
+        self.gate_lock = threading.Lock()
+        self.gate_opened_at = None
+        self.latency_callback = latency_callback
         self.sample_rate = self.RATE
         self.flush_queue = flush_queue
         self.buffer_queue = queue.Queue(maxsize=(buffer_s * 1000 // self.block_duration_ms))
-        self.pa = pyaudio.PyAudio()
-        self.stream = self.pa.open(format=self.FORMAT,
-                                   channels=self.CHANNELS,
-                                   rate=self.sample_rate,
-                                   input=True,
-                                   frames_per_buffer=self.block_size,
-                                   stream_callback=proxy_callback)
-        self.stream.start_stream()
+        self.source = source if source is not None else PyAudioSource()
+        self.source.open(self.sample_rate, self.CHANNELS, self.block_size, proxy_callback)
+        self.source.start()
         self.active = True
 
+    def open_gate(self, before=None):
+        """Start routing blocks to `callback`, calling `before()` first with no block in flight."""
+        with self.gate_lock:
+            if before: before()
+            self.gate = True
+            self.gate_opened_at = time.perf_counter()
+
+    def close_gate(self, after=None):
+        """Stop routing blocks to `callback`; once this returns, the callback will not be called again until reopened."""
+        with self.gate_lock:
+            self.gate = False
+            self.gate_opened_at = None
+            if after: after()
+
+    def _report_latency(self, time_info):
+        """Pass the seconds from `open_gate()` to the capture of the first block after it to `latency_callback`.
+            Uses PortAudio's ADC timestamp to discount input buffering where the host API provides one.
+        """
+        latency = time.perf_counter() - self.gate_opened_at
+        self.gate_opened_at = None
+        if time_info and time_info.get('input_buffer_adc_time'):
+            latency -= time_info['current_time'] - time_info['input_buffer_adc_time']
+        if self.latency_callback: self.latency_callback(latency)
+
+    def _queue_block(self, in_data):
+        try:
+            self.buffer_queue.put(in_data, block=False)
+        except queue.Full:
+            if self.telemetry: self.telemetry.count('capture.dropped_blocks')
+        if self.telemetry: self.telemetry.gauge('capture.queue_depth', self.buffer_queue.qsize())
+
+    def _report_block(self, started_at, status):
+        """Record the callback's duration and its jitter (deviation from one block duration since the previous block)."""
+        now = time.perf_counter()
+        self.telemetry.observe('capture.callback', now - started_at)
+        if self.last_block_at is not None:
+            self.telemetry.observe('capture.jitter', abs(started_at - self.last_block_at - self.block_size / float(self.sample_rate)))
+        self.last_block_at = started_at
+        if status & pyaudio.paInputOverflow:
+            self.telemetry.count('capture.overflows')
+
     def destroy(self):
-        self.stream.stop_stream()
-        self.stream.close()
-        self.pa.terminate()
+        self.source.close()
         self.active = False
 
     def read(self):
@@ -65,22 +228,100 @@ class Audio(object):
     block_duration_ms = property(lambda self: 1000 * self.block_size // self.sample_rate)
 
     def write_wav(self, filename, data):
-        # logging.info("write wav %s", filename)
-        wf = wave.open(filename, 'wb')
-        wf.setnchannels(self.CHANNELS)
         # wf.setsampwidth(self.pa.get_sample_size(FORMAT))
         assert self.FORMAT == pyaudio.paInt16
-        wf.setsampwidth(2)
-        wf.setframerate(self.sample_rate)
-        wf.writeframes(data)
-        wf.close()
+        write_wav(filename, data, sample_rate=self.sample_rate, channels=self.CHANNELS)
+
+
+class CaptureBuffer(object):
+    """Growable byte buffer that the stream callback writes blocks straight into, instead of queueing them.
+        The finished take is handed out as a memoryview with no copying; flushing and dropping blocks only move indices.
+        Between takes the stream keeps running: blocks go to `write_preroll()`, a fixed-size ring holding the last
+        `preroll_ms`, which `start()` puts at the head of the new take so the first syllable is not clipped.
+        Used with a gated `Audio`: `Audio(callback=buf.write, idle_callback=buf.write_preroll, gated=True)`.
+        With a `telemetry.Telemetry`, the take's size and the buffer's reallocations are recorded as it grows, and the
+        pre-roll blocks each take starts with.
+    """
+
+    def __init__(self, block_bytes=2 * Audio.RATE // Audio.BLOCKS_PER_SECOND, initial_s=30, preroll_ms=0, telemetry=None):
+        self.telemetry = telemetry
+        self.block_bytes = block_bytes
+        self.initial_size = int(initial_s * Audio.BLOCKS_PER_SECOND) * block_bytes
+        self.preroll = collections.deque(maxlen=preroll_ms * Audio.BLOCKS_PER_SECOND // 1000)
+        self.lock = threading.Lock()
+        self.recording = False
+        self.buffer = None
+        self.length = 0
+
+    def write(self, block):
+        """Append one block to the take."""
+        with self.lock:
+            end = self.length + len(block)
+            if self.buffer is None:
+                self.buffer = bytearray(max(self.initial_size, end))
+            elif end > len(self.buffer):
+                grown = bytearray(max(2 * len(self.buffer), end))
+                grown[:self.length] = memoryview(self.buffer)[:self.length]
+                self.buffer = grown
+                if self.telemetry: self.telemetry.count('capture.buffer_grows')
+            self.buffer[self.length:end] = block
+            self.length = end
+        if self.telemetry: self.telemetry.gauge('capture.buffer_bytes', end)
+
+    def write_preroll(self, block):
+        """Keep one block in the pre-roll ring, dropping the oldest."""
+        self.preroll.append(block)
+
+    def __len__(self):
+        return self.length
+
+    def start(self):
+        """Start a take, beginning with the pre-roll audio. Returns the number of pre-roll blocks used."""
+        if self.recording:
+            # The previous take was cancelled rather than taken: its tail is the pre-roll
+            with self.lock:
+                tail = min(self.length, self.preroll.maxlen * self.block_bytes)
+                if tail:
+                    self.buffer[:tail] = self.buffer[self.length - tail:self.length]
+                self.length = tail
+            blocks = tail // self.block_bytes
+        else:
+            blocks = len(self.preroll)
+            for block in self.preroll:
+                self.write(block)
+            self.preroll.clear()
+            self.recording = True
+        if self.telemetry: self.telemetry.gauge('capture.preroll_blocks', blocks)
+        return blocks
+
+    def clear(self):
+        """Discard the captured audio, keeping the allocation. Returns the number of blocks discarded."""
+        with self.lock:
+            blocks = self.length // self.block_bytes + len(self.preroll)
+            self.length = 0
+            self.preroll.clear()
+        return blocks
+
+    def take(self, drop_last=None):
+        """End the take, detach the captured audio and return it as a memoryview, without its last `drop_last` blocks.
+            The next take starts a new buffer, so the view stays valid while it is being written out elsewhere.
+        """
+        with self.lock:
+            buffer, length = self.buffer, self.length
+            self.buffer, self.length = None, 0
+            self.recording = False
+        if buffer is None:
+            return memoryview(b'')
+        if drop_last:
+            length = max(0, length - drop_last * self.block_bytes)
+        return memoryview(buffer)[:length]
 
 
 class VADAudio(Audio):
     """Filter & segment audio with voice activity detection."""
 
-    def __init__(self, aggressiveness=3):
-        super(VADAudio, self).__init__()
+    def __init__(self, aggressiveness=3, source=None):
+        super(VADAudio, self).__init__(source=source)
         self.vad = webrtcvad.Vad(aggressiveness)
 
     def vad_collector(self, padding_ms=300, ratio=0.75, blocks=None):
@@ -92,41 +333,103 @@ class VADAudio(Audio):
         if blocks is None: blocks = iter(self)
         num_padding_blocks = padding_ms // self.block_duration_ms
         ring_buffer = collections.deque(maxlen=num_padding_blocks)
+        num_voiced = 0  # running count of voiced blocks in ring_buffer, updated on append and evict
         triggered = False
 
         for block in blocks:
             is_speech = self.vad.is_speech(block, self.sample_rate)
+            if num_padding_blocks:
+                if len(ring_buffer) == num_padding_blocks:
+                    num_voiced -= ring_buffer[0][1]
+                num_voiced += is_speech
 
             if not triggered:
                 ring_buffer.append((block, is_speech))
-                num_voiced = len([f for f, speech in ring_buffer if speech])
                 if num_voiced > ratio * ring_buffer.maxlen:
                     triggered = True
                     for f, s in ring_buffer:
                         yield f
                     ring_buffer.clear()
+                    num_voiced = 0
 
             else:
                 yield block
                 ring_buffer.append((block, is_speech))
-                num_unvoiced = len([f for f, speech in ring_buffer if not speech])
+                num_unvoiced = len(ring_buffer) - num_voiced
                 if num_unvoiced > ratio * ring_buffer.maxlen:
                     triggered = False
                     yield None
                     ring_buffer.clear()
+                    num_voiced = 0
+
+
+def vad_segments(data, sample_rate=Audio.RATE, block_duration_ms=1000 // Audio.BLOCKS_PER_SECOND, padding_ms=300, ratio=0.75, aggressiveness=3):
+    """Offline equivalent of `VADAudio.vad_collector` over a whole take, without opening a stream.
+        `data` is int16 mono PCM (bytes, int16 array, or a take filename in any codec). Returns the utterances as a list of
+        `(start, end)` sample offsets, covering exactly the blocks vad_collector would yield between Nones.
+    """
+    if isinstance(data, str):
+        data, sample_rate = takefile.read(data)
+    buf = memoryview(data).cast('B')
+    block_size = sample_rate * block_duration_ms // 1000
+    step = block_size * 2
+    num_blocks = len(buf) // step
+    num_padding_blocks = padding_ms // block_duration_ms
+    vad = webrtcvad.Vad(aggressiveness)
+    flags = collections.deque(maxlen=num_padding_blocks)
+    num_voiced = 0
+    start = None
+    segments = []
+
+    for i in range(num_blocks):
+        is_speech = vad.is_speech(buf[i * step:(i + 1) * step], sample_rate)
+        if num_padding_blocks:
+            if len(flags) == num_padding_blocks:
+                num_voiced -= flags[0]
+            num_voiced += is_speech
+        flags.append(is_speech)
+
+        if start is None:
+            if num_voiced > ratio * num_padding_blocks:
+                start = i + 1 - len(flags)
+                flags.clear()
+                num_voiced = 0
+        elif len(flags) - num_voiced > ratio * num_padding_blocks:
+            segments.append((start * block_size, (i + 1) * block_size))
+            start = None
+            flags.clear()
+            num_voiced = 0
+
+    if start is not None:
+        segments.append((start * block_size, num_blocks * block_size))
+    return segments
 
 
 class AudioStore(object):
-    """Stores last `maxlen` recognitions as tuples (audio, text, grammar_name, rule_name), indexed in reverse order (0 most recent)"""
+    """Stores recent recognitions as tuples (audio, text, grammar_name, rule_name), indexed in reverse order (0 most recent).
+        Retention is bounded by `max_bytes` of audio held in memory (and by `maxlen` takes, if given). Past the budget,
+        the least recently used takes are spilled to `save_dir` as WAVs, or forgotten without a `save_dir`; spilled takes
+        stay indexable and are read back from disk. The newest `keep_last` takes are never spilled, so a re-record can be
+        A/B compared with the previous attempt instantly. Files are written, and `retain.csv` appended, by a background
+        writer thread, never on the caller's thread; `flush()` waits for it.
+    """
 
-    def __init__(self, audio_obj, maxlen=0, save_dir=None, auto_save_func=None):
+    def __init__(self, audio_obj, maxlen=0, save_dir=None, auto_save_func=None, max_bytes=64 * 1024 * 1024, keep_last=2):
         self.audio_obj = audio_obj
         self.maxlen = maxlen
         self.save_dir = save_dir
         # if self.save_dir and not os.path.exists(self.save_dir): os.makedirs(self.save_dir)
         self.auto_save_func = auto_save_func
-        self.deque = collections.deque(maxlen=maxlen)
+        self.max_bytes = max_bytes
+        self.keep_last = keep_last
         self.blocks = []
+        self.lock = threading.Lock()
+        self.order = collections.deque()  # entries, newest first
+        self.lru = collections.OrderedDict()  # id(entry) -> entry, least recently used first
+        self.bytes = 0
+        self.pending = {}  # filename -> audio queued for the writer, served from memory until written
+        self.writes = queue.Queue()
+        self.writer = None
 
     def add_block(self, block):
         if self.maxlen != 0:
@@ -134,23 +437,128 @@ class AudioStore(object):
 
     def finalize(self, text, grammar_name, rule_name):
         if self.maxlen != 0:
-            audio = ''.join(self.blocks)
-            self.deque.appendleft((audio, text, grammar_name, rule_name))
+            audio = b''.join(self.blocks)
             self.blocks = []
-            if self.auto_save_func and self.auto_save_func(*self.deque[0]): self.save(0)
+            # [audio (None once spilled), text, grammar_name, rule_name, filename (once written or queued)]
+            entry = [audio, text, grammar_name, rule_name, None]
+            with self.lock:
+                self.order.appendleft(entry)
+                self.lru[id(entry)] = entry
+                self.bytes += len(audio)
+                if self.maxlen and len(self.order) > self.maxlen:
+                    dropped = self.order.pop()
+                    self.lru.pop(id(dropped), None)
+                    if dropped[0] is not None:
+                        self.bytes -= len(dropped[0])
+                self._evict()
+            # The entry itself rather than index 0, which is another take if this one was already evicted (keep_last=0)
+            if self.auto_save_func and self.auto_save_func(audio, text, grammar_name, rule_name): self._save(entry)
+
+    def _evict(self):
+        """Spill (or forget, without a save_dir) least recently used takes until within `max_bytes`. Holds `self.lock`."""
+        protected = set(id(entry) for entry in list(self.order)[:self.keep_last])
+        for key in list(self.lru):
+            if self.bytes <= self.max_bytes:
+                break
+            if key in protected:
+                continue
+            entry = self.lru.pop(key)
+            if entry[0] is None:
+                continue
+            self.bytes -= len(entry[0])
+            if self.save_dir:
+                if entry[4] is None:
+                    entry[4] = self._queue_write(entry, csv=False)
+                entry[0] = None
+            else:
+                # By identity: deque.remove() compares with ==, and equal takes are equal lists
+                for i, other in enumerate(self.order):
+                    if other is entry:
+                        del self.order[i]
+                        break
+
+    def _filename(self):
+        return os.path.join(self.save_dir, "retain_" + datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S_%f") + ".wav")
+
+    def _queue_write(self, entry, csv):
+        """Hand a take to the writer thread, starting it if needed. Returns the filename it will be written to."""
+        filename = entry[4] or self._filename()
+        if entry[4] is None:
+            self.pending[filename] = entry[0]
+        self.writes.put((filename, entry[0] if entry[4] is None else None, csv and entry[1:4]))
+        if self.writer is None:
+            self.writer = threading.Thread(target=self._write_loop, name='audio-store-writer', daemon=True)
+            self.writer.start()
+        return filename
+
+    def _write_loop(self):
+        while True:
+            job = self.writes.get()
+            try:
+                if job is None:
+                    return
+                filename, audio, row = job
+                if audio is not None:
+                    self.audio_obj.write_wav(filename, audio)
+                    with self.lock:
+                        self.pending.pop(filename, None)
+                if row:
+                    text, grammar_name, rule_name = row
+                    with open(os.path.join(self.save_dir, "retain.csv"), "a") as csvfile:
+                        csvfile.write(','.join([filename, '0', grammar_name, rule_name, text]) + '\n')
+            except Exception:
+                logging.exception("could not write retained audio")
+            finally:
+                self.writes.task_done()
 
     def save(self, index):
+        """Queue take `index` to be written to `save_dir` and listed in retain.csv. Returns its filename."""
+        with self.lock:
+            entry = self.order[index]
+        return self._save(entry)
+
+    def _save(self, entry):
         if self.save_dir:
-            filename = os.path.join(self.save_dir, "retain_" + datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S_%f") + ".wav")
-            audio, text, grammar_name, rule_name = self.deque[index]
-            self.audio_obj.write_wav(filename, audio)
-            with open(os.path.join(self.save_dir, "retain.csv"), "a") as csvfile:
-                csvfile.write(','.join([filename, '0', grammar_name, rule_name, text]) + '\n')
+            with self.lock:
+                entry[4] = self._queue_write(entry, csv=True)
+                return entry[4]
+
+    def _audio(self, entry):
+        if entry[0] is not None:
+            return entry[0]
+        with self.lock:
+            audio = self.pending.get(entry[4])
+        if audio is not None:
+            return audio
+        wf = wave.open(entry[4], 'rb')
+        audio = wf.readframes(wf.getnframes())
+        wf.close()
+        return audio
 
     def __getitem__(self, key):
-        return self.deque[key]
+        with self.lock:
+            entry = self.order[key]
+            if id(entry) in self.lru:
+                self.lru.move_to_end(id(entry))
+        return (self._audio(entry),) + tuple(entry[1:4])
+
+    def recent(self, count=None):
+        """The newest `count` (default `keep_last`) takes, newest first, e.g. a re-record and the attempt before it."""
+        return [self[i] for i in range(min(len(self), self.keep_last if count is None else count))]
+
+    def flush(self):
+        """Wait for every queued write to reach the disk."""
+        self.writes.join()
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writes.put(None)
+            self.writer.join()
+            self.writer = None
+
     def __len__(self):
-        return len(self.deque)
+        return len(self.order)
     def __bool__(self):
         return True
     def __nonzero__(self):
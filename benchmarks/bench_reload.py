@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""Reload (`-r True`) reconciliation of prompts against recorded takes: `list.remove` per take vs counting.
+
+Usage: python3 benchmarks/bench_reload.py [-n PROMPTS ...] [-s SAMPLES] [--legacy-max PROMPTS]
+"""
+
+import argparse, os, random, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import prompt_loader
+
+
+def reconcile_legacy(file_scripts, recorded_prompts):
+    """The reconciliation `reload_scripts_from_files` used to do."""
+    file_scripts = list(file_scripts)
+    for prompt in recorded_prompts:
+        if prompt in file_scripts:
+            file_scripts.remove(prompt)
+    return file_scripts
+
+
+def synthetic_session(prompts, samples, recorded_ratio=0.5, seed=0):
+    """Each prompt repeated `samples` times, and a shuffled `recorded_ratio` of them (plus some stale takes) recorded."""
+    rng = random.Random(seed)
+    names = ["medicine name %06d" % i for i in range(prompts)]
+    file_scripts = [name for name in names for _ in range(samples)]
+    recorded = rng.sample(file_scripts, int(len(file_scripts) * recorded_ratio))
+    # Takes of prompts that have since been removed from the prompt file
+    recorded += ["retired prompt %d" % i for i in range(prompts // 100)]
+    rng.shuffle(recorded)
+    return file_scripts, recorded
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "-n", "--prompts", type=int, nargs="+", default=[1000, 3000, 10000, 100000]
+    )
+    parser.add_argument("-s", "--samples", type=int, default=5)
+    parser.add_argument(
+        "--legacy-max",
+        type=int,
+        default=10000,
+        help="skip the quadratic version above this many prompts (default: %(default)s)",
+    )
+    args = parser.parse_args()
+
+    print(
+        "%8s %8s %12s %12s %8s"
+        % ("prompts", "takes", "legacy ms", "counter ms", "speedup")
+    )
+    for prompts in args.prompts:
+        file_scripts, recorded = synthetic_session(prompts, args.samples)
+        remaining, counter_s = timed(prompt_loader.reconcile, file_scripts, recorded)
+        if prompts <= args.legacy_max:
+            expected, legacy_s = timed(reconcile_legacy, file_scripts, recorded)
+            assert remaining == expected, (
+                "reconciliation differs at %d prompts" % prompts
+            )
+            legacy = "%12.1f" % (legacy_s * 1000)
+            speedup = "%7.0fx" % (legacy_s / counter_s)
+        else:
+            legacy, speedup = "%12s" % "-", "%8s" % "-"
+        print(
+            "%8d %8d %s %12.1f %s"
+            % (prompts, len(recorded), legacy, counter_s * 1000, speedup)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""Measure recorder.py cold-start: `python -X importtime` per module, and time to the first rendered frame.
+
+Usage: python3 benchmarks/bench_startup.py [-m MODULE ...] [--first-frame] [--max-import-ms MS] [--max-first-frame-ms MS]
+"""
+
+import time
+
+START = time.perf_counter()
+
+import argparse, os, shutil, subprocess, sys, tempfile
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def import_times(module):
+    """Return `(total_ms, [(cumulative_ms, name), ...])` for `import module` and its direct imports, slowest first."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        cwd=ROOT,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    total, children, imports = None, [], []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        ms = int(cumulative) / 1000.0
+        # A module is reported after everything it imports
+        if depth == 1:
+            children.append((ms, name.strip()))
+        elif depth == 0:
+            if name.strip() == module:
+                total, imports = ms, sorted(children, reverse=True)
+            children = []
+    return total, imports
+
+
+def first_frame_child(prompts_filename):
+    """Start the recorder like `recorder.main()` does and print the ms until the window's first frame.
+
+    Audio comes from an empty `ArraySource` rather than a sound device, and takes go to a temporary directory.
+    """
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    import audio
+    import recorder
+    from PySide2.QtGui import QGuiApplication
+    from PySide2.QtQml import QQmlApplicationEngine
+
+    app = QGuiApplication(sys.argv[:1])
+    engine = QQmlApplicationEngine()
+    engine.addImportPath(ROOT)
+    save_dir = tempfile.mkdtemp(prefix="bench_startup_")
+    try:
+        rec = recorder.Recorder(
+            save_dir, prompts_filename, source=audio.ArraySource(b"")
+        )
+        engine.rootContext().setContextProperty("recorder", rec)
+        engine.load(os.path.join(ROOT, "recorder.qml"))
+        rec.window = engine.rootObjects()[0]
+
+        def on_frame():
+            print("%.1f" % ((time.perf_counter() - START) * 1000))
+            app.quit()
+
+        rec.window.frameSwapped.connect(on_frame)
+        app.exec_()
+        rec.audio.destroy()
+        rec.processor.shutdown(wait=True)
+        rec.qc_processor.shutdown(wait=True)
+        rec.playback_processor.shutdown(wait=True)
+        rec.store.close()
+    finally:
+        shutil.rmtree(save_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-m", "--modules", nargs="+", default=["recorder"])
+    parser.add_argument("-n", "--top", type=int, default=10)
+    parser.add_argument("--first-frame", action="store_true")
+    parser.add_argument("-p", "--prompts_filename", default="prompts/commands.txt")
+    parser.add_argument("--max-import-ms", type=float)
+    parser.add_argument("--max-first-frame-ms", type=float)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        first_frame_child(args.prompts_filename)
+        return
+
+    failed = False
+    for module in args.modules:
+        try:
+            total, imports = import_times(module)
+        except RuntimeError as e:
+            print("import %s failed: %s" % (module, e))
+            failed = True
+            continue
+        print("import %s: %.1f ms" % (module, total))
+        for ms, name in imports[: args.top]:
+            print("  %8.1f ms  %s" % (ms, name))
+        if args.max_import_ms is not None and total > args.max_import_ms:
+            print("  slower than --max-import-ms %.1f" % args.max_import_ms)
+            failed = True
+
+    if args.first_frame:
+        proc = subprocess.run(
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                "--child",
+                "-p",
+                args.prompts_filename,
+            ],
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+        )
+        if proc.returncode != 0 or not proc.stdout.strip():
+            print("first frame: recorder failed to start")
+            failed = True
+        else:
+            first_frame = float(proc.stdout.strip().splitlines()[-1])
+            print("first frame: %.1f ms" % first_frame)
+            if (
+                args.max_first_frame_ms is not None
+                and first_frame > args.max_first_frame_ms
+            ):
+                print(
+                    "  slower than --max-first-frame-ms %.1f" % args.max_first_frame_ms
+                )
+                failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""Time every hot path of the recorder over a range of input sizes, and compare against a stored baseline.
+
+Usage: python3 benchmarks/bench_suite.py [-b BENCH ...] [-r REPEAT] [--full] [-o RESULTS.json] [--baseline BASELINE.json] [-t THRESHOLD]
+
+Each benchmark is timed `REPEAT` times per size. The minimum is kept as the figure of merit, and the median is
+kept for reference. Results are written as JSON with a log-log scaling exponent per benchmark (1 is linear).
+With `--baseline`, every benchmark and size in both runs is compared, and the exit status is 1 if any of them
+got slower by more than THRESHOLD (a fraction, default 0.25). Save a run with `-o` to use it as a baseline.
+"""
+
+import argparse, datetime, json, os, platform, random, shutil, statistics, sys, tempfile, time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import audio
+import headless
+import manifest
+import prompt_loader
+import trimming
+from bench_trim import synthetic_dictation
+from recorder import Recorder
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+PROMPT_NAME = "bench"
+
+
+def timings(run, repeat, before=None, min_s=0.02):
+    """Seconds per call of `run()`, measured `repeat` times, calling `before()` untimed ahead of each.
+
+    Without `before`, calls faster than `min_s` are timed in batches lasting at least that long, like timeit,
+    so sub-millisecond paths are not lost in timer noise.
+    """
+    number = 1
+    if before is None:
+        start = time.perf_counter()
+        run()
+        number = max(1, int(min_s / max(time.perf_counter() - start, 1e-9)))
+    result = []
+    for _ in range(repeat):
+        if before:
+            before()
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        result.append((time.perf_counter() - start) / number)
+    return result
+
+
+def make_recorder(save_dir, prompts_filename, **kwargs):
+    """A `Recorder` with no microphone or window (see headless.py), for calling its methods directly."""
+    kwargs.setdefault("stream_trim", False)
+    kwargs.setdefault("source", audio.ArraySource(b""))
+    recorder = Recorder(save_dir, prompts_filename, **kwargs)
+    recorder.window = headless.HeadlessWindow()
+    recorder.window.setProperty("saveDir", save_dir)
+    recorder.window.setProperty("promptsName", PROMPT_NAME)
+    return recorder
+
+
+def close_recorder(recorder):
+    recorder.audio.destroy()
+    recorder.processor.shutdown(wait=True)
+    recorder.qc_processor.shutdown(wait=True)
+    recorder.store.close()
+
+
+def write_prompts(filename, lines, seed=0):
+    """An arctic-style prompt file of `lines` distinct synthetic prompts."""
+    rng = random.Random(seed)
+    words = ["amoxicillin", "take", "twice", "daily", "with", "food", "tablet", "dose"]
+    with open(filename, "w") as file:
+        for i in range(lines):
+            text = " ".join(rng.choice(words) for _ in range(rng.randint(3, 12)))
+            file.write('bench_%07d "%s %d"\n' % (i, text, i))
+
+
+def take_rows(save_dir, count, prompts=None):
+    """`count` manifest rows as `saveFile` writes them, recording `prompts` round-robin."""
+    dirname = os.path.join(save_dir, PROMPT_NAME)
+    return [
+        [
+            os.path.join(dirname, "recorder_2024-01-01_00-00-00_%07d.flac" % i),
+            "0",
+            PROMPT_NAME,
+            "",
+            prompts[i % len(prompts)] if prompts else "prompt %d" % i,
+        ]
+        for i in range(count)
+    ]
+
+
+def write_manifests(save_dir, rows):
+    manifest.write_tsv(save_dir, rows)
+    manifest.write_tsv(os.path.join(save_dir, PROMPT_NAME), rows)
+
+
+def bench_trim_long_silences(seconds, repeat, tmp_dir, args):
+    wav = synthetic_dictation(seconds / 60.0)
+    return timings(lambda: trimming.trim_long_silences(wav), repeat)
+
+
+def bench_vad_collector(seconds, repeat, tmp_dir, args):
+    vad_audio = audio.VADAudio(source=audio.ArraySource(b""))
+    pcm = trimming.to_pcm16(synthetic_dictation(seconds / 60.0)).tobytes()
+    step = 2 * vad_audio.block_size
+    blocks = [pcm[i : i + step] for i in range(0, len(pcm) - step + 1, step)]
+    try:
+        return timings(
+            lambda: sum(1 for _ in vad_audio.vad_collector(blocks=blocks)), repeat
+        )
+    finally:
+        vad_audio.destroy()
+
+
+def bench_read_audio(seconds, repeat, tmp_dir, args):
+    """A take captured through the stream callback, then `Recorder.read_audio`."""
+    pcm = trimming.to_pcm16(synthetic_dictation(seconds / 60.0)).tobytes()
+    prompts_filename = os.path.join(tmp_dir, "prompts.txt")
+    write_prompts(prompts_filename, 10)
+    source = audio.ArraySource(pcm, loop=True)
+    recorder = make_recorder(
+        os.path.join(tmp_dir, "output"), prompts_filename, source=source
+    )
+
+    def take():
+        recorder.startRecording()
+        source.pump(seconds=seconds)
+        recorder.audio.close_gate()
+        recorder.read_audio(drop_last=3)
+
+    try:
+        return timings(take, repeat)
+    finally:
+        close_recorder(recorder)
+
+
+def bench_save_delete(rows, repeat, tmp_dir, args):
+    """One `saveFile` and the `deleteTranscript` of that take, against a manifest of `rows` takes."""
+    save_dir = os.path.join(tmp_dir, "output")
+    write_manifests(save_dir, take_rows(save_dir, rows))
+    prompts_filename = os.path.join(tmp_dir, "prompts.txt")
+    write_prompts(prompts_filename, 10)
+    recorder = make_recorder(save_dir, prompts_filename, store=args.store)
+    # The manifest is loaded on first use, which is timed separately by manifest_load
+    recorder.store.scripts(PROMPT_NAME)
+    counter = iter(range(sys.maxsize))
+
+    def save_delete():
+        filename = os.path.join(
+            save_dir,
+            PROMPT_NAME,
+            "recorder_2030-01-01_00-00-00_%07d.flac" % next(counter),
+        )
+        recorder.saveFile(PROMPT_NAME, filename, "a new take", PROMPT_NAME)
+        recorder.deleteTranscript(PROMPT_NAME, filename)
+
+    try:
+        return timings(save_delete, repeat)
+    finally:
+        close_recorder(recorder)
+
+
+def bench_manifest_load(rows, repeat, tmp_dir, args):
+    """Opening the store and listing a prompt's takes, as the validation view does at startup."""
+    save_dir = os.path.join(tmp_dir, "output")
+    write_manifests(save_dir, take_rows(save_dir, rows))
+    if args.store == "sqlite":
+        # Import the TSV manifests once, untimed
+        manifest.SqliteStore(save_dir).close()
+
+    def load():
+        store = manifest.STORES[args.store](save_dir)
+        store.scripts(PROMPT_NAME)
+        if args.store == "sqlite":
+            store.close()
+
+    return timings(load, repeat)
+
+
+def bench_get_scripts_from_file(lines, repeat, tmp_dir, args, cached=False):
+    """`Recorder.get_scripts_from_file` on a synthetic prompt file, or one of prompts/ when `lines` is a name."""
+    if isinstance(lines, str):
+        prompts_filename = os.path.join(ROOT, "prompts", lines + ".txt")
+    else:
+        prompts_filename = os.path.join(tmp_dir, "prompts.txt")
+        write_prompts(prompts_filename, lines)
+    recorder = make_recorder(os.path.join(tmp_dir, "output"), prompts_filename)
+    cache_dir = os.path.join(recorder.save_dir, ".prompts_cache")
+
+    def clear_cache():
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    run = lambda: recorder.get_scripts_from_file(None, prompts_filename)
+    try:
+        if cached:
+            run()
+            return timings(run, repeat)
+        return timings(run, repeat, before=clear_cache)
+    finally:
+        close_recorder(recorder)
+
+
+def bench_get_scripts_from_file_cached(lines, repeat, tmp_dir, args):
+    return bench_get_scripts_from_file(lines, repeat, tmp_dir, args, cached=True)
+
+
+def bench_reload_scripts_from_files(prompts, repeat, tmp_dir, args):
+    """Reloading a session (`-r True`) of `prompts` prompts, 5 takes each, half of them recorded."""
+    prompts_filename = os.path.join(tmp_dir, "prompts.txt")
+    write_prompts(prompts_filename, prompts)
+    texts = [prompt for line, prompt in prompt_loader.load_prompts(prompts_filename)]
+    save_dir = os.path.join(tmp_dir, "output")
+    write_manifests(save_dir, take_rows(save_dir, len(texts) * 5 // 2, texts))
+    recorder = make_recorder(
+        save_dir, prompts_filename, reload_scripts=True, store=args.store
+    )
+    try:
+        return timings(
+            lambda: recorder.reload_scripts_from_files(
+                None, prompts_filename, PROMPT_NAME
+            ),
+            repeat,
+        )
+    finally:
+        close_recorder(recorder)
+
+
+def bench_split_script(chars, repeat, tmp_dir, args):
+    rng = random.Random(0)
+    words = []
+    while sum(len(word) + 1 for word in words) < chars:
+        words.append("x" * rng.randint(2, 12))
+    script = " ".join(words)
+    return timings(lambda: Recorder.split_script(script, 80), repeat)
+
+
+# name -> (function, unit, sizes, extra sizes run with --full)
+BENCHMARKS = {
+    "trim_long_silences": (bench_trim_long_silences, "s", [10, 60, 300], [1800]),
+    "vad_collector": (bench_vad_collector, "s", [10, 60, 300], [1800]),
+    "read_audio": (bench_read_audio, "s", [3, 30, 300], [1800]),
+    "save_delete": (bench_save_delete, "rows", [1000, 10000, 100000], [1000000]),
+    "manifest_load": (bench_manifest_load, "rows", [1000, 10000, 100000], [1000000]),
+    "get_scripts_from_file": (
+        bench_get_scripts_from_file,
+        "lines",
+        ["arctic", "timit", 10000, 100000],
+        [1000000],
+    ),
+    "get_scripts_from_file_cached": (
+        bench_get_scripts_from_file_cached,
+        "lines",
+        [10000, 100000],
+        [1000000],
+    ),
+    "reload_scripts_from_files": (
+        bench_reload_scripts_from_files,
+        "prompts",
+        [1000, 10000],
+        [100000],
+    ),
+    "split_script": (bench_split_script, "chars", [1000, 10000, 100000], [1000000]),
+}
+
+
+def scaling_exponent(sizes):
+    """Slope of log(time) over log(size) for the numeric sizes: ~1 for linear, ~2 for quadratic."""
+    points = [
+        (float(size), result["min"])
+        for size, result in sizes.items()
+        if size.isdigit() and result["min"] > 0
+    ]
+    if len(points) < 2:
+        return None
+    x, y = np.log([p[0] for p in points]), np.log([p[1] for p in points])
+    return round(float(np.polyfit(x, y, 1)[0]), 2)
+
+
+def compare(results, baseline, threshold):
+    """Print each benchmark's change against `baseline`; returns the `(name, size)` pairs slower than `threshold`."""
+    regressions = []
+    print()
+    print(
+        "%-30s %10s %12s %12s %8s"
+        % ("vs baseline", "size", "base ms", "now ms", "change")
+    )
+    for name, sizes in results["benchmarks"].items():
+        base_sizes = baseline.get("benchmarks", {}).get(name, {}).get("sizes", {})
+        for size, result in sizes["sizes"].items():
+            if size not in base_sizes:
+                continue
+            base, now = base_sizes[size]["min"], result["min"]
+            change = now / base - 1 if base > 0 else 0.0
+            slower = change > threshold
+            if slower:
+                regressions.append((name, size))
+            print(
+                "%-30s %10s %12.3f %12.3f %+7.0f%%%s"
+                % (
+                    name,
+                    size,
+                    base * 1000,
+                    now * 1000,
+                    change * 100,
+                    "  SLOWER" if slower else "",
+                )
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "-b",
+        "--bench",
+        nargs="+",
+        choices=sorted(BENCHMARKS),
+        default=sorted(BENCHMARKS),
+    )
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="include the largest sizes (1M rows, 30 min takes)",
+    )
+    parser.add_argument("-s", "--store", choices=sorted(manifest.STORES), default="tsv")
+    parser.add_argument("-o", "--output", help="write the results to this JSON file")
+    parser.add_argument(
+        "--baseline", help="JSON results of an earlier run to compare against"
+    )
+    parser.add_argument(
+        "-t",
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="fail when a benchmark is slower than the baseline by more than this fraction (default: %(default)s)",
+    )
+    args = parser.parse_args()
+
+    results = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "store": args.store,
+        "repeat": args.repeat,
+        "benchmarks": {},
+    }
+    print("%-30s %10s %12s %12s" % ("benchmark", "size", "min ms", "median ms"))
+    for name in args.bench:
+        func, unit, sizes, full_sizes = BENCHMARKS[name]
+        measured = {}
+        for size in sizes + (full_sizes if args.full else []):
+            tmp_dir = tempfile.mkdtemp(prefix="bench_")
+            try:
+                times = func(size, args.repeat, tmp_dir, args)
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+            measured[str(size)] = {
+                "min": min(times),
+                "median": statistics.median(times),
+                "times": times,
+            }
+            print(
+                "%-30s %10s %12.3f %12.3f"
+                % (name, size, min(times) * 1000, statistics.median(times) * 1000)
+            )
+        results["benchmarks"][name] = {
+            "unit": unit,
+            "sizes": measured,
+            "scaling_exponent": scaling_exponent(measured),
+        }
+        print(
+            "%-30s %10s %12s"
+            % ("", "exponent", results["benchmarks"][name]["scaling_exponent"])
+        )
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(
+                "%d benchmark sizes slower than the baseline by more than %.0f%%"
+                % (len(regressions), args.threshold * 100)
+            )
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Per-take post-processing latency: the old write/reload/trim/rewrite round trip vs trimming the int16 capture once.
+
+Usage: python3 benchmarks/bench_take.py [-r REPEAT] [-s SECONDS ...]
+"""
+
+import argparse, os, sys, tempfile, time
+
+import numpy as np
+import soundfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import audio
+import trimming
+from bench_trim import synthetic_dictation
+
+
+def load_wav_file(filename):
+    """`Utils.load_wav_file`, falling back to soundfile (same samples) when librosa is not installed."""
+    try:
+        import librosa
+    except ImportError:
+        return soundfile.read(filename, dtype="float32")
+    return librosa.load(filename, sr=None, mono=True, dtype=np.float32)
+
+
+def take_before(data, filename):
+    audio.write_wav(filename, data)
+    wav, source_sr = load_wav_file(filename)
+    wav = trimming.trim_long_silences(wav)
+    soundfile.write(str(filename), wav, source_sr)
+
+
+def take_after(data, filename):
+    pcm = np.frombuffer(data, dtype=np.int16)
+    audio.write_wav(
+        filename, [pcm[start:end] for start, end in trimming.trim_spans(pcm)]
+    )
+
+
+def best_of(func, data, filename, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(data, filename)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument(
+        "-s", "--seconds", type=float, nargs="+", default=[3, 10, 30, 120]
+    )
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    before_wav = os.path.join(tmp_dir, "before.wav")
+    after_wav = os.path.join(tmp_dir, "after.wav")
+    print("%8s %12s %12s %8s" % ("take s", "before ms", "after ms", "speedup"))
+    for seconds in args.seconds:
+        data = memoryview(
+            trimming.to_pcm16(synthetic_dictation(seconds / 60.0)).tobytes()
+        )
+        before_s = best_of(take_before, data, before_wav, args.repeat)
+        after_s = best_of(take_after, data, after_wav, args.repeat)
+        before, _ = soundfile.read(before_wav, dtype="int16")
+        after, _ = soundfile.read(after_wav, dtype="int16")
+        print(
+            "%8.0f %12.2f %12.2f %7.1fx%s"
+            % (
+                seconds,
+                before_s * 1000,
+                after_s * 1000,
+                before_s / after_s,
+                "" if len(before) == len(after) else "  (lengths differ)",
+            )
+        )
+        os.remove(before_wav)
+        os.remove(after_wav)
+    os.rmdir(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""Compare `trimming.trim_long_silences` with the original struct.pack/np.repeat implementation.
+
+Usage: python3 benchmarks/bench_trim.py [-r REPEAT] [-m MINUTES]
+"""
+
+import argparse, os, struct, sys, time
+
+import numpy as np
+from scipy.ndimage import binary_dilation
+import soundfile
+import webrtcvad
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import trimming
+from trimming import (
+    int16_max,
+    sample_rate,
+    vad_max_silence_length,
+    vad_moving_average_width,
+    vad_window_length,
+)
+
+
+def trim_long_silences_legacy(wav):
+    """The previous `recorder.trim_long_silences`, kept verbatim (bar the removed `np.bool` alias) as a reference."""
+    samples_per_window = (vad_window_length * sample_rate) // 1000
+    wav = wav[: len(wav) - (len(wav) % samples_per_window)]
+    pcm_wave = struct.pack(
+        "%dh" % len(wav), *(np.round(wav * int16_max)).astype(np.int16)
+    )
+    voice_flags = []
+    vad = webrtcvad.Vad(mode=3)
+    for window_start in range(0, len(wav), samples_per_window):
+        window_end = window_start + samples_per_window
+        voice_flags.append(
+            vad.is_speech(
+                pcm_wave[window_start * 2 : window_end * 2], sample_rate=sample_rate
+            )
+        )
+    voice_flags = np.array(voice_flags)
+
+    def moving_average(array, width):
+        array_padded = np.concatenate(
+            (np.zeros((width - 1) // 2), array, np.zeros(width // 2))
+        )
+        ret = np.cumsum(array_padded, dtype=float)
+        ret[width:] = ret[width:] - ret[:-width]
+        return ret[width - 1 :] / width
+
+    audio_mask = moving_average(voice_flags, vad_moving_average_width)
+    audio_mask = np.round(audio_mask).astype(bool)
+    audio_mask = binary_dilation(audio_mask, np.ones(vad_max_silence_length + 1))
+    audio_mask = np.repeat(audio_mask, samples_per_window)
+    return wav[audio_mask == True]
+
+
+def synthetic_dictation(minutes, seed=0):
+    """Alternate noisy 'speech' bursts and near-silence, as a float32 waveform."""
+    rng = np.random.default_rng(seed)
+    total = int(minutes * 60 * sample_rate)
+    wav = rng.normal(0, 0.001, total).astype(np.float32)
+    pos = 0
+    while pos < total:
+        voiced = int(rng.uniform(0.3, 3.0) * sample_rate)
+        t = np.arange(min(voiced, total - pos)) / sample_rate
+        tone = 0.3 * np.sin(2 * np.pi * rng.uniform(100, 300) * t)
+        wav[pos : pos + len(t)] += (tone + rng.normal(0, 0.05, len(t))).astype(
+            np.float32
+        )
+        pos += voiced + int(rng.uniform(0.1, 2.0) * sample_rate)
+    return np.clip(wav, -1.0, 1.0)
+
+
+def best_of(func, wav, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(wav)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    parser.add_argument("-m", "--minutes", type=float, default=10)
+    parser.add_argument(
+        "-w", "--wav", default=os.path.join(os.path.dirname(__file__), "..", "test.wav")
+    )
+    args = parser.parse_args()
+
+    inputs = []
+    if os.path.isfile(args.wav):
+        wav, _ = soundfile.read(args.wav, dtype="float32")
+        inputs.append(("test.wav", wav))
+    inputs.append(("synthetic %gmin" % args.minutes, synthetic_dictation(args.minutes)))
+
+    print(
+        "%-18s %10s %10s %10s %8s"
+        % ("input", "audio s", "legacy s", "new s", "speedup")
+    )
+    for name, wav in inputs:
+        legacy_s, expected = best_of(trim_long_silences_legacy, wav, args.repeat)
+        new_s, result = best_of(trimming.trim_long_silences, wav, args.repeat)
+        if not np.array_equal(expected, result):
+            sys.exit("%s: trimmed output differs from the legacy implementation" % name)
+        print(
+            "%-18s %10.1f %10.3f %10.3f %7.1fx"
+            % (name, len(wav) / sample_rate, legacy_s, new_s, legacy_s / new_s)
+        )
+
+
+if __name__ == "__main__":
+    main()
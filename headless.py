@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+import argparse, logging, time
+
+import audio
+import manifest
+import takefile
+from recorder import Recorder
+
+
+class HeadlessWindow(object):
+    """Stands in for recorder.qml's window: the properties `Recorder` reads and writes, with the QML defaults."""
+
+    def __init__(self):
+        self.properties = {
+            "validation": False,
+            "recording": False,
+            "promptsName": "",
+            "promptTitle": "",
+            "scriptText": "",
+            "scriptFilename": "",
+            "saveDir": ".",
+            "pendingTakes": 0,
+            "promptProgress": "",
+        }
+
+    def property(self, name):
+        return self.properties.get(name)
+
+    def setProperty(self, name, value):
+        self.properties[name] = value
+
+
+def run(
+    prompts_filename,
+    save_dir,
+    source,
+    takes=100,
+    take_s=3.0,
+    paced=False,
+    rerecord_every=0,
+    **kwargs
+):
+    """Record `takes` takes of the prompts in `prompts_filename` through a `Recorder`, with no microphone or UI.
+
+    Each take is `take_s` seconds of `source` (a take filename, or int16 PCM), looped: delivered in real time with
+    `paced`, or as fast as the pipeline takes it otherwise. Every `rerecord_every`th take re-records the previous
+    prompt, going through the delete path as well. `kwargs` are passed to `Recorder`.
+    Returns `(takes, seconds)` once every take has been written.
+    """
+    source = audio.ArraySource(source, paced=paced, loop=True)
+    recorder = Recorder(save_dir, prompts_filename, source=source, **kwargs)
+    recorder.window = window = HeadlessWindow()
+    recorder.takeProcessed.connect(
+        lambda filename, ok: window.setProperty(
+            "pendingTakes", window.property("pendingTakes") - 1
+        )
+    )
+    recorder.init()
+    model = recorder.scriptModel
+    rows = model.rowCount()
+    if not rows:
+        raise Exception("no prompts to record in '%s'" % prompts_filename)
+
+    start = time.perf_counter()
+    row = 0
+    for i in range(takes):
+        rerecord = rerecord_every and i and i % rerecord_every == 0
+        if not rerecord:
+            row = i % rows
+        window.setProperty("scriptText", model.script(row))
+        window.setProperty("scriptFilename", model.filename(row))
+        recorder.startRecording()
+        if paced:
+            time.sleep(take_s)
+        else:
+            source.pump(seconds=take_s)
+        recorder.finishRecording()
+        model.setFilename(row, window.property("scriptFilename"))
+    recorder.processor.shutdown(wait=True)
+    recorder.qc_processor.shutdown(wait=True)
+    elapsed = time.perf_counter() - start
+
+    recorder.audio.destroy()
+    recorder.store.close()
+    recorder.telemetry.close()
+    if recorder.station_lock is not None:
+        recorder.station_lock.release()
+    return takes, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="""
+        Drive the recorder's take pipeline (capture, trimming, encoding, manifest and
+        quality metrics) without a microphone or window, from an audio file played in
+        as the input, e.g. to load test it with thousands of takes.
+    """
+    )
+    parser.add_argument("prompts_filename", help="file containing prompts to record")
+    parser.add_argument("source", help="audio file played in as the microphone input")
+    parser.add_argument(
+        "-d",
+        "--save_dir",
+        default="./output",
+        help="where to save the takes (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-n",
+        "--takes",
+        type=int,
+        default=100,
+        help="number of takes to record (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-l",
+        "--take_s",
+        type=float,
+        default=3.0,
+        help="length of each take in seconds (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-P",
+        "--paced",
+        action="store_true",
+        help="deliver audio in real time, like a microphone, instead of as fast as possible",
+    )
+    parser.add_argument(
+        "-e",
+        "--rerecord_every",
+        type=int,
+        default=0,
+        help="re-record the previous prompt every this many takes (default: never)",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=2,
+        help="background threads processing finished takes (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-t",
+        "--stream_trim",
+        action="store_true",
+        help="trim silences while recording instead of after each take",
+    )
+    parser.add_argument("-s", "--store", choices=sorted(manifest.STORES), default="tsv")
+    parser.add_argument(
+        "-f", "--codec", choices=sorted(takefile.CODECS), default="flac"
+    )
+    parser.add_argument(
+        "-x",
+        "--metrics_file",
+        help="write per-stage latency histograms here (.prom for Prometheus text, JSON otherwise)",
+    )
+    args = parser.parse_args()
+
+    takes, elapsed = run(
+        args.prompts_filename,
+        args.save_dir,
+        args.source,
+        takes=args.takes,
+        take_s=args.take_s,
+        paced=args.paced,
+        rerecord_every=args.rerecord_every,
+        prompts_count=max(args.takes, 1),
+        workers=args.workers,
+        stream_trim=args.stream_trim,
+        store=args.store,
+        codec=args.codec,
+        metrics_file=args.metrics_file,
+    )
+    print(
+        "%d takes of %.1f s in %.2f s: %.1f takes/s, %.0fx real time"
+        % (
+            takes,
+            args.take_s,
+            elapsed,
+            takes / elapsed,
+            takes * args.take_s / elapsed,
+        )
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=20)
+    main()
@@ -0,0 +1,555 @@
+#!/usr/bin/env python3
+
+import argparse, contextlib, logging, os, pathlib, socket, sqlite3, threading
+
+import takefile
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+
+@contextlib.contextmanager
+def locked(file, shared=False):
+    """Hold an advisory lock on an open file while appending to or reading it.
+
+    Uses POSIX record locks, which (unlike `flock`) are also honoured across NFS clients.
+    """
+    if fcntl is not None:
+        fcntl.lockf(file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield file
+        finally:
+            fcntl.lockf(file, fcntl.LOCK_UN)
+    else:
+        # Lock the first byte; appends still go to the end of the file
+        position = file.tell()
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+        file.seek(position)
+        try:
+            yield file
+        finally:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+            file.seek(position)
+
+
+# Multi-station sessions: each station records into save_dir/stations/<station>, a save_dir of its own
+STATIONS_DIR = "stations"
+
+
+def station_dirs(save_dir):
+    """The shard directories of every station that has recorded into `save_dir`."""
+    root = os.path.join(save_dir, STATIONS_DIR)
+    if not os.path.isdir(root):
+        return []
+    return [
+        os.path.join(root, name)
+        for name in sorted(os.listdir(root))
+        if os.path.isdir(os.path.join(root, name))
+    ]
+
+
+class StationLock(object):
+    """Claims a station's shard directory (`station.lock`) for the lifetime of one recorder process.
+
+    Each station appends only to its own manifests, so concurrent stations never contend for a file; the lock
+    makes a second recorder started with the same station name fail instead of interleaving appends.
+    """
+
+    FILENAME = "station.lock"
+
+    def __init__(self, dirname):
+        self.path = os.path.join(dirname, self.FILENAME)
+        self.file = open(self.path, "a+")
+        try:
+            if fcntl is not None:
+                fcntl.lockf(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                self.file.seek(0)
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            self.file.seek(0)
+            owner = self.file.read().strip()
+            self.file.close()
+            raise Exception(
+                "station '%s' is in use by %s" % (dirname, owner or "another recorder")
+            )
+        self.file.seek(0)
+        self.file.truncate()
+        self.file.write("%s pid %d\n" % (socket.gethostname(), os.getpid()))
+        self.file.flush()
+
+    def release(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class Manifest(object):
+    """A `recorder.tsv` file with an in-memory index of its rows, keyed by take filename.
+
+    Rows are appended to the TSV as before. Deleting a take removes it from the index in O(1) and appends a
+    tombstone (`<tsv size>\\t<filename>`) to `recorder.tsv.tombstones` instead of rewriting the TSV; once enough
+    tombstones accumulate the TSV is compacted on a background thread. `export()` (and `compact()`) write exactly
+    the bytes the old rewrite-on-delete scheme would have produced.
+    """
+
+    FILENAME = "recorder.tsv"
+    TOMBSTONES_SUFFIX = ".tombstones"
+
+    def __init__(self, dirname, compact_min=100, compact_ratio=0.1):
+        self.dirname = dirname
+        self.path = os.path.join(dirname, self.FILENAME)
+        self.tombstones_path = self.path + self.TOMBSTONES_SUFFIX
+        self.compact_min = compact_min
+        self.compact_ratio = compact_ratio
+        self.lock = threading.RLock()
+        self.compactor = None
+        self.load()
+
+    def load(self):
+        with self.lock:
+            deleted = {}
+            if os.path.exists(self.tombstones_path):
+                with open(self.tombstones_path, "r") as file, locked(file, shared=True):
+                    for line in file:
+                        offset, _, filename = line.rstrip("\n").partition("\t")
+                        deleted[filename] = max(int(offset), deleted.get(filename, 0))
+
+            # key -> (offset, raw line); comment lines are kept for export under a unique key
+            self.rows = {}
+            offset = 0
+            if os.path.exists(self.path):
+                with open(self.path, "r", newline="") as file, locked(
+                    file, shared=True
+                ):
+                    for line in file:
+                        key = self.key(line, offset)
+                        if deleted.get(key, -1) <= offset:
+                            self.rows[key] = (offset, line)
+                        offset += len(line.encode())
+            self.size = offset
+            self.num_tombstones = len(deleted)
+
+    @staticmethod
+    def key(line, offset):
+        if line.startswith(";") or not line.strip():
+            return (";", offset)
+        return line.split("\t", 1)[0].strip()
+
+    def add(self, fields):
+        """Append a row (list of column values, the first being the take filename)."""
+        line = "\t".join(fields) + os.linesep
+        with self.lock:
+            with open(self.path, "a", newline="") as file, locked(file):
+                file.write(line)
+            self.rows[fields[0]] = (self.size, line)
+            self.size += len(line.encode())
+
+    def remove(self, filename):
+        """Drop the row for `filename`, returning False if it was not in the manifest."""
+        with self.lock:
+            if self.rows.pop(filename, None) is None:
+                return False
+            with open(self.tombstones_path, "a") as file, locked(file):
+                file.write("%d\t%s\n" % (self.size, filename))
+            self.num_tombstones += 1
+            if self.num_tombstones >= max(
+                self.compact_min, self.compact_ratio * len(self.rows)
+            ):
+                self.compact_in_background()
+            return True
+
+    def __contains__(self, filename):
+        return filename in self.rows
+
+    def scripts(self):
+        """Return the live rows, as lists of column values, in file order."""
+        with self.lock:
+            return [
+                line.rstrip("\r\n").split("\t")
+                for key, (offset, line) in self.rows.items()
+                if not isinstance(key, tuple)
+            ]
+
+    def export(self, path):
+        """Write the live rows to `path` in the original TSV layout, byte for byte."""
+        tmp_path = path + ".tmp"
+        with self.lock:
+            with open(tmp_path, "w", newline="") as file:
+                for offset, line in self.rows.values():
+                    file.write(line)
+        os.replace(tmp_path, path)
+
+    def compact(self):
+        """Rewrite the TSV without its deleted rows and clear the tombstones."""
+        with self.lock:
+            if not self.num_tombstones:
+                return
+            self.export(self.path)
+            offset = 0
+            for key, (_, line) in self.rows.items():
+                self.rows[key] = (offset, line)
+                offset += len(line.encode())
+            self.size = offset
+            if os.path.exists(self.tombstones_path):
+                os.remove(self.tombstones_path)
+            self.num_tombstones = 0
+            logging.debug("compacted %s to %s rows", self.path, len(self.rows))
+
+    def compact_in_background(self):
+        with self.lock:
+            if self.compactor is not None and self.compactor.is_alive():
+                return
+            self.compactor = threading.Thread(target=self.compact, daemon=True)
+            self.compactor.start()
+
+    def close(self):
+        """Wait for a background compaction and compact whatever is left, leaving a plain TSV on disk."""
+        if self.compactor is not None:
+            self.compactor.join()
+        self.compact()
+
+
+def write_tsv(dirname, scripts):
+    """Write `dirname/recorder.tsv` from scratch with the given rows, atomically."""
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    path = os.path.join(dirname, Manifest.FILENAME)
+    with open(path + ".tmp", "w", newline="") as file:
+        for fields in scripts:
+            file.write("\t".join(fields) + os.linesep)
+    os.replace(path + ".tmp", path)
+
+
+class MetricsLog(object):
+    """Per-take quality metrics in `recorder.qc.tsv`: a header row of metric names, then one row per take.
+
+    Rows are only ever appended; when a take is measured again its latest row wins. A row holding only a
+    filename is a tombstone: the take was deleted, and its earlier rows no longer count.
+    """
+
+    FILENAME = "recorder.qc.tsv"
+
+    def __init__(self, dirname):
+        self.path = os.path.join(dirname, self.FILENAME)
+        self.lock = threading.Lock()
+        self.columns = None
+        if os.path.exists(self.path):
+            with open(self.path, "r") as file:
+                self.columns = file.readline().rstrip("\n").split("\t")[1:]
+
+    def add(self, filename, metrics):
+        with self.lock:
+            if self.columns is None:
+                self.columns = list(metrics)
+                with open(self.path, "w") as file:
+                    file.write("\t".join(["filename"] + self.columns) + "\n")
+            row = [filename] + [str(metrics.get(column, "")) for column in self.columns]
+            with open(self.path, "a") as file, locked(file):
+                file.write("\t".join(row) + "\n")
+
+    def remove(self, filename):
+        with self.lock:
+            if self.columns is None:
+                return
+            with open(self.path, "a") as file, locked(file):
+                file.write(filename + "\n")
+
+    def metrics(self):
+        """Return `{filename: {metric: value}}`."""
+        result = {}
+        with self.lock:
+            if self.columns is None:
+                return result
+            with open(self.path, "r") as file:
+                next(file)
+                for line in file:
+                    fields = line.rstrip("\n").split("\t")
+                    if len(fields) == 1:
+                        result.pop(fields[0], None)
+                        continue
+                    result.setdefault(fields[0], {}).update(
+                        (column, float(value))
+                        for column, value in zip(self.columns, fields[1:])
+                        if value
+                    )
+        return result
+
+
+class TsvStore(object):
+    """Takes recorded into `save_dir/recorder.tsv` and `save_dir/<prompt_name>/recorder.tsv`.
+
+    With `read_only`, `close()` leaves the manifests as they are instead of compacting them, so a store can be
+    read under a station that is still recording.
+    """
+
+    def __init__(self, save_dir, read_only=False):
+        self.save_dir = save_dir
+        self.read_only = read_only
+        self.lock = threading.Lock()
+        self.manifests = {}
+        self.metrics_log = MetricsLog(save_dir)
+
+    def get_manifest(self, dirname):
+        dirname = os.path.normpath(dirname)
+        with self.lock:
+            if dirname not in self.manifests:
+                self.manifests[dirname] = Manifest(dirname)
+            return self.manifests[dirname]
+
+    def dirnames(self, prompt_name):
+        return [self.save_dir, os.path.join(self.save_dir, prompt_name)]
+
+    def add(self, prompt_name, fields):
+        for dirname in self.dirnames(prompt_name):
+            self.get_manifest(dirname).add(fields)
+
+    def remove(self, prompt_name, filename):
+        for dirname in self.dirnames(prompt_name):
+            self.get_manifest(dirname).remove(filename)
+        self.remove_metrics(filename)
+
+    def scripts(self, prompt_name=None):
+        if prompt_name is None:
+            return self.get_manifest(self.save_dir).scripts()
+        return self.get_manifest(os.path.join(self.save_dir, prompt_name)).scripts()
+
+    def prompt_names(self):
+        if not os.path.isdir(self.save_dir):
+            return []
+        return sorted(
+            name
+            for name in os.listdir(self.save_dir)
+            if os.path.isfile(os.path.join(self.save_dir, name, Manifest.FILENAME))
+        )
+
+    def add_metrics(self, filename, metrics):
+        self.metrics_log.add(filename, metrics)
+
+    def remove_metrics(self, filename):
+        self.metrics_log.remove(filename)
+
+    def metrics(self):
+        return self.metrics_log.metrics()
+
+    def close(self):
+        if self.read_only:
+            return
+        with self.lock:
+            manifests = list(self.manifests.values())
+        for manifest in manifests:
+            manifest.close()
+
+
+class SqliteStore(object):
+    """Takes recorded into a single WAL-mode SQLite database, `save_dir/recorder.sqlite`.
+
+    Holds the same rows as the TSV manifests, with indexes on prompt name, prompt text and filename. Existing
+    TSV manifests are imported when the database is first created; `export()` regenerates them.
+    With `read_only`, an existing database is opened read-only; without one, the TSV manifests are read into a
+    database in memory, and nothing is written to `save_dir`.
+    """
+
+    FILENAME = "recorder.sqlite"
+    COLUMNS = (
+        "filename",
+        "prompt_category_prefix",
+        "prompt_category",
+        "prompt_prefix",
+        "prompt",
+    )
+
+    def __init__(self, save_dir, read_only=False):
+        self.save_dir = save_dir
+        self.path = os.path.join(save_dir, self.FILENAME)
+        self.lock = threading.Lock()
+        is_new = not os.path.exists(self.path)
+        if read_only and not is_new:
+            self.db = sqlite3.connect(
+                pathlib.Path(os.path.abspath(self.path)).as_uri() + "?mode=ro",
+                uri=True,
+                check_same_thread=False,
+            )
+            return
+        # Shared by the GUI thread and the take workers, serialized by self.lock
+        self.db = sqlite3.connect(
+            ":memory:" if read_only else self.path, check_same_thread=False
+        )
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS takes ("
+                " id INTEGER PRIMARY KEY,"
+                " prompt_name TEXT NOT NULL,"
+                " filename TEXT NOT NULL UNIQUE,"
+                " prompt_category_prefix TEXT,"
+                " prompt_category TEXT,"
+                " prompt_prefix TEXT,"
+                " prompt TEXT,"
+                " codec TEXT)"
+            )
+            # Databases created before takes could be compressed
+            if "codec" not in [
+                row[1] for row in self.db.execute("PRAGMA table_info(takes)")
+            ]:
+                self.db.execute("ALTER TABLE takes ADD COLUMN codec TEXT")
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS takes_prompt_name ON takes (prompt_name, id)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS takes_prompt ON takes (prompt)")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS qc ("
+                " filename TEXT NOT NULL,"
+                " metric TEXT NOT NULL,"
+                " value REAL,"
+                " PRIMARY KEY (filename, metric))"
+            )
+        if is_new:
+            self.import_tsv()
+
+    def import_tsv(self):
+        """Load takes from existing TSV manifests, taking each take's prompt name from its subdirectory."""
+        if not os.path.isdir(self.save_dir):
+            return
+        rows = []
+        for prompt_name in sorted(os.listdir(self.save_dir)):
+            dirname = os.path.join(self.save_dir, prompt_name)
+            if os.path.isfile(os.path.join(dirname, Manifest.FILENAME)):
+                rows.extend(
+                    (prompt_name, fields)
+                    for fields in Manifest(dirname).scripts()
+                    if len(fields) == len(self.COLUMNS)
+                )
+        # Keep the root manifest's order where there is one
+        order = {}
+        if os.path.isfile(os.path.join(self.save_dir, Manifest.FILENAME)):
+            for i, fields in enumerate(Manifest(self.save_dir).scripts()):
+                order.setdefault(fields[0], i)
+        rows.sort(key=lambda row: order.get(row[1][0], len(order)))
+        self.add_many(rows)
+        logging.debug("imported %s takes into %s", len(rows), self.path)
+
+    def add_many(self, rows):
+        """Insert `(prompt_name, fields)` rows in one transaction, with each take's codec from its filename."""
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO takes (prompt_name, %s, codec) VALUES (?, ?, ?, ?, ?, ?, ?)"
+                % ", ".join(self.COLUMNS),
+                [
+                    (prompt_name,) + tuple(fields) + (takefile.codec_of(fields[0]),)
+                    for prompt_name, fields in rows
+                ],
+            )
+
+    def remove_many(self, filenames):
+        """Delete the takes for `filenames` in one transaction."""
+        rows = [(filename,) for filename in filenames]
+        with self.lock, self.db:
+            self.db.executemany("DELETE FROM takes WHERE filename = ?", rows)
+            self.db.executemany("DELETE FROM qc WHERE filename = ?", rows)
+
+    def add(self, prompt_name, fields):
+        self.add_many([(prompt_name, fields)])
+
+    def remove(self, prompt_name, filename):
+        self.remove_many([filename])
+
+    def scripts(self, prompt_name=None):
+        query = "SELECT %s FROM takes" % ", ".join(self.COLUMNS)
+        with self.lock:
+            if prompt_name is None:
+                cursor = self.db.execute(query + " ORDER BY id")
+            else:
+                cursor = self.db.execute(
+                    query + " WHERE prompt_name = ? ORDER BY id", (prompt_name,)
+                )
+            return [list(row) for row in cursor]
+
+    def remove_metrics(self, filename):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM qc WHERE filename = ?", (filename,))
+
+    def add_metrics(self, filename, metrics):
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO qc (filename, metric, value) VALUES (?, ?, ?)",
+                [(filename, metric, value) for metric, value in metrics.items()],
+            )
+
+    def metrics(self):
+        """Return `{filename: {metric: value}}`."""
+        result = {}
+        with self.lock:
+            for filename, metric, value in self.db.execute(
+                "SELECT filename, metric, value FROM qc"
+            ):
+                result.setdefault(filename, {})[metric] = value
+        return result
+
+    def prompt_names(self):
+        with self.lock:
+            return [
+                row[0]
+                for row in self.db.execute(
+                    "SELECT DISTINCT prompt_name FROM takes ORDER BY prompt_name"
+                )
+            ]
+
+    def export(self, save_dir=None):
+        """Regenerate the TSV manifests (root and one per prompt name) under `save_dir`."""
+        save_dir = save_dir or self.save_dir
+
+        write_tsv(save_dir, self.scripts())
+        for prompt_name in self.prompt_names():
+            write_tsv(os.path.join(save_dir, prompt_name), self.scripts(prompt_name))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+STORES = {"tsv": TsvStore, "sqlite": SqliteStore}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compact a recorder.tsv manifest, export its live rows to another TSV, "
+        "or regenerate the TSV manifests from a recorder.sqlite database."
+    )
+    parser.add_argument("dirname", help="directory containing recorder.tsv")
+    parser.add_argument(
+        "-o", "--output", help="export to this file instead of compacting in place"
+    )
+    parser.add_argument(
+        "-s",
+        "--store",
+        choices=sorted(STORES),
+        default="tsv",
+        help="with sqlite, regenerate the TSV manifests from dirname/recorder.sqlite "
+        "into dirname, or into the -o directory (default: %(default)s)",
+    )
+    args = parser.parse_args()
+
+    if args.store == "sqlite":
+        store = SqliteStore(args.dirname)
+        store.export(args.output)
+        store.close()
+        return
+
+    manifest = Manifest(args.dirname)
+    if args.output:
+        manifest.export(args.output)
+    else:
+        manifest.compact()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=10)
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+import argparse, logging, os
+
+import manifest
+
+
+def is_station_take(filename):
+    return manifest.STATIONS_DIR in os.path.normpath(filename).split(os.sep)
+
+
+def unsharded_rows(dirname):
+    """Rows of `dirname/recorder.tsv` recorded without a station, which a merge into `dirname` must keep."""
+    if not os.path.isfile(os.path.join(dirname, manifest.Manifest.FILENAME)):
+        return []
+    return [
+        fields
+        for fields in manifest.Manifest(dirname).scripts()
+        if not is_station_take(fields[0])
+    ]
+
+
+def merge(save_dir, output_dir=None, store="tsv"):
+    """Combine the manifests of every station under `save_dir` into one corpus index in `output_dir`.
+
+    Writes `recorder.tsv` with every take, one `<prompt_name>/recorder.tsv` per prompt and the merged
+    `recorder.qc.tsv`, in recording order. The shards themselves are only read;
+    takes already in `output_dir`'s manifests that were recorded without a station are kept.
+    """
+    output_dir = output_dir or save_dir
+    rows = unsharded_rows(output_dir)
+    prompt_rows, metrics = {}, {}
+    for prompt_name in manifest.TsvStore(output_dir).prompt_names():
+        kept = unsharded_rows(os.path.join(output_dir, prompt_name))
+        if kept:
+            prompt_rows[prompt_name] = kept
+    if os.path.isfile(os.path.join(output_dir, manifest.MetricsLog.FILENAME)):
+        metrics.update(
+            (filename, take)
+            for filename, take in manifest.MetricsLog(output_dir).metrics().items()
+            if not is_station_take(filename)
+        )
+    shards = manifest.station_dirs(save_dir)
+    for shard in shards:
+        shard_store = manifest.STORES[store](shard, read_only=True)
+        rows.extend(shard_store.scripts())
+        for prompt_name in shard_store.prompt_names():
+            prompt_rows.setdefault(prompt_name, []).extend(
+                shard_store.scripts(prompt_name)
+            )
+        metrics.update(shard_store.metrics())
+        shard_store.close()
+
+    # Take filenames start with their recording time, so this interleaves the stations chronologically
+    def by_time(fields):
+        return os.path.basename(fields[0])
+
+    def write(dirname, scripts):
+        manifest.write_tsv(dirname, sorted(scripts, key=by_time))
+        # Deleted rows are already left out
+        tombstones_path = (
+            os.path.join(dirname, manifest.Manifest.FILENAME)
+            + manifest.Manifest.TOMBSTONES_SUFFIX
+        )
+        if os.path.exists(tombstones_path):
+            os.remove(tombstones_path)
+
+    write(output_dir, rows)
+    for prompt_name, scripts in prompt_rows.items():
+        write(os.path.join(output_dir, prompt_name), scripts)
+
+    metrics_path = os.path.join(output_dir, manifest.MetricsLog.FILENAME)
+    if os.path.exists(metrics_path):
+        os.remove(metrics_path)
+    if metrics:
+        metrics_log = manifest.MetricsLog(output_dir)
+        for fields in sorted(rows, key=by_time):
+            if fields[0] in metrics:
+                metrics_log.add(fields[0], metrics[fields[0]])
+
+    logging.info(
+        "merged %d takes of %d prompts from %d stations into %s",
+        len(rows),
+        len(prompt_rows),
+        len(shards),
+        output_dir,
+    )
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="""
+        Merge the per-station manifests of a multi-station session (recorded with
+        `recorder.py --station NAME`) into a single corpus index.
+    """
+    )
+    parser.add_argument("save_dir", help="directory containing the stations/ directory")
+    parser.add_argument(
+        "-o",
+        "--output_dir",
+        help="write the merged manifests here instead of into save_dir",
+    )
+    parser.add_argument(
+        "-s",
+        "--store",
+        choices=sorted(manifest.STORES),
+        default="tsv",
+        help="store the stations recorded with (default: %(default)s)",
+    )
+    args = parser.parse_args()
+    merge(args.save_dir, args.output_dir, args.store)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=20)
+    main()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+
+import argparse, hashlib, io, json, logging, os, re, sys, tarfile, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import manifest
+import takefile
+
+INDEX_FILENAME = "index.tsv"
+SUMS_FILENAME = "SHA256SUMS"
+SHARD_PATTERN = re.compile(r"^(.+)-(\d{6})\.tar$")
+BUFFER_SIZE = 4 * 1024 * 1024
+
+
+class HashingWriter(object):
+    """File-like wrapper that hashes and counts everything written through it."""
+
+    def __init__(self, file):
+        self.file = file
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.digest.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+
+def sample_key(filename):
+    """WebDataset key of a take: its path without extension, with no dots (they separate key and field)."""
+    path = os.path.splitext(os.path.normpath(filename))[0].replace(os.sep, "/")
+    return path.lstrip("./").replace(".", "_")
+
+
+def write_shard(path, samples):
+    """Write `samples` of `(key, audio_path, metadata)` as an uncompressed tar to `path`.
+
+    Each take becomes `<key>.<codec extension>`, `<key>.txt` (the transcript) and `<key>.json` (its manifest row
+    and quality metrics), WebDataset style. The tar is streamed out through a large buffer and takes are read
+    whole-file in the order given. Runs in a worker process; returns `(path, sha256, size, count)`.
+    """
+    with open(path, "wb", buffering=BUFFER_SIZE) as file:
+        writer = HashingWriter(file)
+        with tarfile.open(
+            fileobj=writer, mode="w|", format=tarfile.USTAR_FORMAT, bufsize=BUFFER_SIZE
+        ) as tar:
+            for key, audio_path, metadata in samples:
+                mtime = int(os.path.getmtime(audio_path))
+                info = tar.gettarinfo(audio_path, key + os.path.splitext(audio_path)[1])
+                info.uid = info.gid = 0
+                info.uname = info.gname = ""
+                with open(audio_path, "rb", buffering=BUFFER_SIZE) as audio:
+                    tar.addfile(info, audio)
+                for ext, data in (
+                    (".txt", metadata["transcript"].encode("utf-8")),
+                    (".json", json.dumps(metadata, sort_keys=True).encode("utf-8")),
+                ):
+                    info = tarfile.TarInfo(key + ext)
+                    info.size, info.mtime = len(data), mtime
+                    tar.addfile(info, io.BytesIO(data))
+    return path, writer.digest.hexdigest(), writer.size, len(samples)
+
+
+def read_sums(output_dir):
+    """Shard name -> sha256, from `output_dir/SHA256SUMS` (`sha256sum -c` compatible)."""
+    sums = {}
+    path = os.path.join(output_dir, SUMS_FILENAME)
+    if os.path.exists(path):
+        with open(path, "r") as file:
+            for line in file:
+                checksum, name = line.rstrip("\n").split("  ", 1)
+                sums[name] = checksum
+    return sums
+
+
+def packaged_filenames(output_dir):
+    """Filenames of the takes already in a shard, from `output_dir/index.tsv`."""
+    path = os.path.join(output_dir, INDEX_FILENAME)
+    if not os.path.exists(path):
+        return set()
+    with open(path, "r") as file:
+        return {line.split("\t", 3)[2] for line in file if line.strip()}
+
+
+def corpus_rows(save_dir, store="tsv"):
+    """Every take of a corpus as `(prompt_name, fields)`, including those still in unmerged station shards."""
+    rows, seen = [], set()
+    metrics = {}
+    for dirname in [save_dir] + manifest.station_dirs(save_dir):
+        corpus_store = manifest.STORES[store](dirname, read_only=True)
+        for prompt_name in corpus_store.prompt_names():
+            for fields in corpus_store.scripts(prompt_name):
+                if fields[0] not in seen:
+                    seen.add(fields[0])
+                    rows.append((prompt_name, fields))
+        metrics.update(corpus_store.metrics())
+        corpus_store.close()
+    return rows, metrics
+
+
+def plan_shards(samples, shard_bytes):
+    """Split `(key, audio_path, metadata, size)` samples into consecutive shards of about `shard_bytes` each."""
+    shards, shard, total = [], [], 0
+    for key, audio_path, metadata, size in samples:
+        if shard and total + size > shard_bytes:
+            shards.append(shard)
+            shard, total = [], 0
+        shard.append((key, audio_path, metadata))
+        total += size
+    if shard:
+        shards.append(shard)
+    return shards
+
+
+def package(
+    save_dir,
+    output_dir,
+    store="tsv",
+    shard_bytes=1024 * 1024 * 1024,
+    prefix="corpus",
+    jobs=None,
+):
+    """Package the takes of `save_dir` not yet exported into new tar shards in `output_dir`.
+
+    Shards are numbered on from the last export and built in parallel. Each one is written to a temporary file
+    and only renamed into place, checksummed in `SHA256SUMS` and listed in `index.tsv` (`shard`, `key`, then the
+    take's manifest row) once complete, so an interrupted export is picked up again by the next run.
+    Returns the list of new shard names.
+    """
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    for name in os.listdir(output_dir):
+        if name.endswith(".tar.tmp"):
+            os.remove(os.path.join(output_dir, name))
+    numbers = [
+        int(match.group(2))
+        for match in map(SHARD_PATTERN.match, read_sums(output_dir))
+        if match
+    ]
+    next_number = max(numbers) + 1 if numbers else 0
+
+    done = packaged_filenames(output_dir)
+    rows, metrics = corpus_rows(save_dir, store)
+    samples = []
+    missing = 0
+    for prompt_name, fields in rows:
+        if fields[0] in done:
+            continue
+        audio_path = takefile.resolve(fields[0], save_dir)
+        try:
+            size = os.path.getsize(audio_path)
+        except OSError:
+            missing += 1
+            logging.warning("missing take %s", audio_path)
+            continue
+        metadata = {
+            "filename": fields[0],
+            "prompt_name": prompt_name,
+            "fields": list(fields),
+            "transcript": fields[4] if len(fields) > 4 else "",
+            "metrics": metrics.get(fields[0], {}),
+        }
+        samples.append((sample_key(fields[0]), audio_path, metadata, size))
+    # Read the takes in on-disk path order, so each shard streams through a directory sequentially
+    samples.sort(key=lambda sample: sample[1])
+    shards = plan_shards(samples, shard_bytes)
+
+    names = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor, open(
+        os.path.join(output_dir, INDEX_FILENAME), "a"
+    ) as index, open(os.path.join(output_dir, SUMS_FILENAME), "a") as sums:
+        futures = {}
+        for number, shard in enumerate(shards, next_number):
+            name = "%s-%06d.tar" % (prefix, number)
+            path = os.path.join(output_dir, name + ".tmp")
+            futures[executor.submit(write_shard, path, shard)] = (name, shard)
+        for future in as_completed(futures):
+            name, shard = futures[future]
+            tmp_path, checksum, size, count = future.result()
+            os.replace(tmp_path, os.path.join(output_dir, name))
+            sums.write("%s  %s\n" % (checksum, name))
+            sums.flush()
+            index.write(
+                "".join(
+                    "\t".join([name, key] + metadata["fields"]) + "\n"
+                    for key, _, metadata in shard
+                )
+            )
+            index.flush()
+            names.append(name)
+            logging.info("%s: %d takes, %d bytes", name, count, size)
+
+    logging.info(
+        "packaged %d takes into %d shards, %d already packaged, %d missing",
+        len(samples),
+        len(names),
+        len(done),
+        missing,
+    )
+    return sorted(names)
+
+
+def verify(output_dir, jobs=None):
+    """Check every shard against `SHA256SUMS`; returns the names of the ones that do not match."""
+    sums = read_sums(output_dir)
+    names = sorted(sums)
+    paths = [os.path.join(output_dir, name) for name in names]
+    failed = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for name, path, checksum in zip(
+            names, paths, executor.map(checksum_or_none, paths)
+        ):
+            if checksum != sums[name]:
+                failed.append(name)
+                logging.error("%s: checksum mismatch", path)
+    return failed
+
+
+def checksum_or_none(path):
+    try:
+        return takefile.file_hash(path, "sha256", BUFFER_SIZE)
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="""
+        Export a corpus as WebDataset-style tar shards with SHA256SUMS and an index.
+        Only takes recorded since the last export are packaged into new shards.
+    """
+    )
+    parser.add_argument("save_dir", help="directory containing recorder.tsv")
+    parser.add_argument("output_dir", help="directory for the shards and index")
+    parser.add_argument("-s", "--store", choices=sorted(manifest.STORES), default="tsv")
+    parser.add_argument(
+        "-b",
+        "--shard_mb",
+        type=float,
+        default=1024,
+        help="approximate size of each shard in MB (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-p",
+        "--prefix",
+        default="corpus",
+        help="shard name prefix (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="shards built in parallel (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-c",
+        "--check",
+        action="store_true",
+        help="only verify the existing shards against SHA256SUMS",
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.check:
+        failed = verify(args.output_dir, args.jobs)
+        print(
+            "%d shards failed verification in %.1f s"
+            % (len(failed), time.perf_counter() - start)
+        )
+        sys.exit(1 if failed else 0)
+    names = package(
+        args.save_dir,
+        args.output_dir,
+        args.store,
+        int(args.shard_mb * 1024 * 1024),
+        args.prefix,
+        args.jobs,
+    )
+    print("%d new shards in %.1f s" % (len(names), time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=20)
+    main()
@@ -0,0 +1,60 @@
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+
+class TakeProcessor(object):
+    """Runs post-take jobs on a thread pool, off the Qt GUI thread.
+
+    Jobs are keyed (by take filename): jobs sharing a key run in submission order, and `cancel(key)` drops any of
+    that key's jobs which have not started yet.
+    """
+
+    def __init__(self, max_workers=2):
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="take"
+        )
+        self.lock = threading.Lock()
+        self.futures = {}
+
+    def submit(self, key, func, *args, **kwargs):
+        """Queue `func(*args, **kwargs)` to run after every job already queued for `key`. Returns a future."""
+        with self.lock:
+            previous = self.futures.get(key)
+            future = self.executor.submit(self._run_after, previous, func, args, kwargs)
+            self.futures[key] = future
+        future.add_done_callback(lambda f: self._forget(key, f))
+        return future
+
+    def cancel(self, key):
+        """Cancel the pending job for `key`, returning True if it had not started yet."""
+        with self.lock:
+            future = self.futures.get(key)
+        return future is not None and future.cancel()
+
+    def pending(self, key):
+        with self.lock:
+            future = self.futures.get(key)
+        return future is not None and not future.done()
+
+    def __len__(self):
+        """Number of keys with jobs queued or running."""
+        with self.lock:
+            return len(self.futures)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+    @staticmethod
+    def _run_after(previous, func, args, kwargs):
+        if previous is not None:
+            try:
+                previous.result()
+            except (CancelledError, Exception):
+                # Cancelled, or already reported by the previous job itself
+                pass
+        return func(*args, **kwargs)
+
+    def _forget(self, key, future):
+        with self.lock:
+            if self.futures.get(key) is future:
+                del self.futures[key]
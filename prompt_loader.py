@@ -0,0 +1,98 @@
+import collections, itertools, json, logging, os, re
+
+from takefile import file_hash
+
+# Prompt file formats: name -> pattern extracting the prompt text from a line
+FORMATS = {
+    # arctic_a0001 "Author of the danger trail, Philip Steels, etc."
+    "arctic": re.compile(r'^\w+ "(.*)"$'),
+    # It was time to go up myself. (si486)
+    "timit": re.compile(r"^(.*) \(s.\d+\)$"),
+    "plain": None,
+}
+DETECT_LINES = 20
+CACHE_VERSION = 1
+
+
+def iter_lines(filename):
+    """Stream the prompt lines of a file, stripped, skipping `;` comments and blank lines."""
+    with open(filename, "r") as file:
+        for line in file:
+            if line.startswith(";"):
+                continue
+            line = line.strip()
+            if line:
+                yield line
+
+
+def detect_format(lines):
+    """Name of the format most of `lines` match, "plain" if none."""
+    counts = {
+        name: sum(1 for line in lines if pattern.match(line))
+        for name, pattern in FORMATS.items()
+        if pattern is not None
+    }
+    best = max(counts, key=counts.get) if counts else "plain"
+    return best if counts.get(best) else "plain"
+
+
+def iter_prompts(filename):
+    """Yield `(line, prompt)` for every line of a prompt file, lazily.
+
+    The format is detected once from the first lines; lines not matching its pattern are used as they are.
+    """
+    lines = iter_lines(filename)
+    head = list(itertools.islice(lines, DETECT_LINES))
+    pattern = FORMATS[detect_format(head)]
+    for line in itertools.chain(head, lines):
+        match = pattern.match(line) if pattern is not None else None
+        yield line, match.group(1) if match else line
+
+
+def load_prompts(filename, cache_dir=None):
+    """Return the distinct prompts of a file as `(line, prompt)` pairs, in file order.
+
+    Duplicate prompts keep their first line. With `cache_dir`, the parsed list is cached there as JSON keyed by
+    the file's SHA-1, so unchanged prompt files are not parsed again.
+    """
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = os.path.join(cache_dir, file_hash(filename) + ".json")
+        try:
+            with open(cache_path, "r") as file:
+                cached = json.load(file)
+            if cached.get("version") == CACHE_VERSION:
+                return [tuple(pair) for pair in cached["prompts"]]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    prompts = {}
+    for line, prompt in iter_prompts(filename):
+        prompts.setdefault(prompt, line)
+    pairs = [(line, prompt) for prompt, line in prompts.items()]
+
+    if cache_path is not None:
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            with open(cache_path + ".tmp", "w") as file:
+                json.dump({"version": CACHE_VERSION, "prompts": pairs}, file)
+            os.replace(cache_path + ".tmp", cache_path)
+        except OSError as e:
+            logging.debug("could not cache prompts of %s: %s", filename, e)
+    return pairs
+
+
+def reconcile(file_scripts, recorded_prompts):
+    """Remove one occurrence from `file_scripts` per recorded prompt, keeping the order of the rest.
+
+    Same result as `file_scripts.remove(prompt)` for each recorded prompt found in it, in linear time.
+    """
+    recorded = collections.Counter(recorded_prompts)
+    remaining = []
+    for script in file_scripts:
+        if recorded[script]:
+            recorded[script] -= 1
+        else:
+            remaining.append(script)
+    return remaining
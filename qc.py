@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+import argparse, logging, math, os, sys, time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import manifest
+import takefile
+import trimming
+
+# Metric name -> True if larger values are worse, for ranking the worst takes first
+METRICS = {
+    "duration": False,
+    "rms_db": False,
+    "peak_db": True,
+    "clipped": True,
+    "voiced_ratio": False,
+    "snr_db": False,
+    "truncated": True,
+}
+
+
+def db(power):
+    return 10 * math.log10(max(power, 1e-10))
+
+
+def take_metrics(pcm, rate=trimming.sample_rate, window_length=None):
+    """Quality metrics of one take (int16 samples), for ranking takes that need listening to.
+
+    Levels are in dBFS, `clipped` counts samples at full scale, `voiced_ratio` is the fraction of VAD windows
+    with speech, `snr_db` compares the mean power of voiced and unvoiced windows, and `truncated` is 1 when the
+    last window is still voiced (speech running into the end of the take).
+    """
+    if window_length is None:
+        window_length = trimming.vad_window_length
+    pcm = np.asarray(pcm, dtype=np.int16)
+    samples_per_window = (window_length * rate) // 1000
+    n_windows = len(pcm) // samples_per_window
+    if not len(pcm):
+        return dict(
+            duration=0.0,
+            rms_db=db(0),
+            peak_db=db(0),
+            clipped=0,
+            voiced_ratio=0.0,
+            snr_db=0.0,
+            truncated=0,
+        )
+
+    # Every level comes from the squared samples, summed once per VAD window
+    squares = np.square(pcm, dtype=np.float64)
+    window_power = (
+        squares[: n_windows * samples_per_window]
+        .reshape(n_windows, samples_per_window)
+        .mean(axis=1)
+    )
+    full_scale = float(trimming.int16_max) ** 2
+    peak = max(int(pcm.max()), -int(pcm.min()))
+
+    voiced = trimming.detect_voice_windows(pcm, samples_per_window, rate=rate)
+    if voiced.any() and not voiced.all():
+        signal, noise = window_power[voiced].mean(), window_power[~voiced].mean()
+    elif n_windows:
+        # No silence (or no speech) to compare against: use the loud and quiet ends of the take
+        noise, signal = np.percentile(window_power, [10, 90])
+    else:
+        signal = noise = squares.mean()
+
+    return dict(
+        duration=round(len(pcm) / float(rate), 3),
+        rms_db=round(db(squares.mean() / full_scale), 2),
+        peak_db=round(db(peak * peak / full_scale), 2),
+        clipped=int(
+            np.count_nonzero(np.abs(pcm, dtype=np.int32) >= trimming.int16_max)
+        ),
+        voiced_ratio=round(float(voiced.mean()) if n_windows else 0.0, 3),
+        snr_db=round(db(signal) - db(noise), 2),
+        truncated=int(bool(n_windows) and bool(voiced[-1])),
+    )
+
+
+def describe(metrics):
+    """One line summary of a take's metrics for the validation list, empty if it has not been measured."""
+    if not metrics:
+        return ""
+    return "SNR %.1f dB, RMS %.1f dBFS, peak %.1f dBFS, %d clipped, %d%% voiced%s" % (
+        metrics.get("snr_db", 0),
+        metrics.get("rms_db", 0),
+        metrics.get("peak_db", 0),
+        metrics.get("clipped", 0),
+        100 * metrics.get("voiced_ratio", 0),
+        ", cut off" if metrics.get("truncated") else "",
+    )
+
+
+def worst_first(scripts, metrics, metric, percent=None):
+    """Order `(filename, ...)` scripts worst first by `metric`, keeping the worst `percent`% if given.
+
+    Takes without metrics sort last.
+    """
+    reverse = METRICS[metric]
+    measured = [script for script in scripts if metric in metrics.get(script[0], {})]
+    unmeasured = [
+        script for script in scripts if metric not in metrics.get(script[0], {})
+    ]
+    measured.sort(key=lambda script: metrics[script[0]][metric], reverse=reverse)
+    ranked = measured + unmeasured
+    if percent is not None:
+        ranked = ranked[: max(1, int(math.ceil(len(ranked) * percent / 100.0)))]
+    return ranked
+
+
+def measure_file(path):
+    """Metrics of a take on disk. Runs in a worker process; returns `(path, metrics, error)`."""
+    try:
+        pcm, rate = takefile.read(path)
+        return path, take_metrics(pcm, rate), None
+    except Exception as e:
+        return path, None, "%s: %s" % (e.__class__.__name__, e)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="""
+        Compute quality metrics for takes in a save_dir that do not have them yet
+        (e.g. recorded before metrics were collected), and list the worst takes.
+    """
+    )
+    parser.add_argument("save_dir", help="directory containing recorder.tsv")
+    parser.add_argument("-s", "--store", choices=sorted(manifest.STORES), default="tsv")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="worker processes (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-f", "--force", action="store_true", help="recompute existing metrics too"
+    )
+    parser.add_argument(
+        "-m",
+        "--metric",
+        choices=sorted(METRICS),
+        default="snr_db",
+        help="list takes worst first by this metric (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-w",
+        "--worst",
+        type=float,
+        default=5,
+        help="percentage of takes to list (default: %(default)s)",
+    )
+    args = parser.parse_args()
+
+    store = manifest.STORES[args.store](args.save_dir)
+    metrics = store.metrics()
+    scripts = store.scripts()
+    paths = {}
+    for fields in scripts:
+        if args.force or fields[0] not in metrics:
+            path = takefile.resolve(fields[0], args.save_dir)
+            if os.path.isfile(path):
+                paths[path] = fields[0]
+
+    start = time.perf_counter()
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        for path, take, error in executor.map(measure_file, paths, chunksize=16):
+            if error:
+                failed += 1
+                logging.error("%s: %s", path, error)
+                continue
+            store.add_metrics(paths[path], take)
+            metrics[paths[path]] = take
+    print(
+        "%d measured, %d failed in %.1f s"
+        % (len(paths) - failed, failed, time.perf_counter() - start)
+    )
+
+    for fields in worst_first(scripts, metrics, args.metric, args.worst):
+        print(
+            "%10s  %s" % (metrics.get(fields[0], {}).get(args.metric, "-"), fields[0])
+        )
+    store.close()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=20)
+    main()
@@ -1,12 +1,8 @@
 #!/usr/bin/env python3
 
-import argparse, datetime, logging, math, os, os.path, random, re, sys
+import argparse, collections, datetime, logging, math, os, os.path, random, re, sys, time
 
-import struct
 import numpy as np
-from scipy.ndimage import binary_dilation
-import webrtcvad
-import soundfile
 
 from Utils import *
 
@@ -20,65 +16,26 @@ from PySide2.QtQml import QQmlApplicationEngine, qmlRegisterType
 from PySide2.QtCore import Qt, QUrl, QObject, Property, Signal, Slot
 
 import audio
+import manifest
+import processing
+import prompt_loader
+import qc
+import script_model
+import takefile
+import spectrogram
+import telemetry
+import trimming
 
 IS_SHUFFLE = False
 
-# For silence trimming
-vad_moving_average_width = 8
-int16_max = (2**15) - 1
-vad_window_length = 30
-sample_rate = 16000
-vad_max_silence_length = 6
-
-
-# Source: CorentinJ - Real Time Voice Cloning - Thanks for this one!
-def trim_long_silences(wav):
-
-    # Compute the voice detection window size
-    samples_per_window = (vad_window_length * sample_rate) // 1000
-
-    # Trim the end of the audio to have a multiple of the window size
-    wav = wav[: len(wav) - (len(wav) % samples_per_window)]
-
-    # Convert the float waveform to 16-bit mono PCM
-    pcm_wave = struct.pack(
-        "%dh" % len(wav), *(np.round(wav * int16_max)).astype(np.int16)
-    )
-
-    # Perform voice activation detection
-    voice_flags = []
-    vad = webrtcvad.Vad(mode=3)
-    for window_start in range(0, len(wav), samples_per_window):
-        window_end = window_start + samples_per_window
-        voice_flags.append(
-            vad.is_speech(
-                pcm_wave[window_start * 2 : window_end * 2], sample_rate=sample_rate
-            )
-        )
-    voice_flags = np.array(voice_flags)
-
-    # Smooth the voice detection with a moving average
-    def moving_average(array, width):
-        array_padded = np.concatenate(
-            (np.zeros((width - 1) // 2), array, np.zeros(width // 2))
-        )
-        ret = np.cumsum(array_padded, dtype=float)
-        ret[width:] = ret[width:] - ret[:-width]
-        return ret[width - 1 :] / width
-
-    audio_mask = moving_average(voice_flags, vad_moving_average_width)
-    audio_mask = np.round(audio_mask).astype(np.bool)
-
-    # Dilate the voiced regions
-    audio_mask = binary_dilation(audio_mask, np.ones(vad_max_silence_length + 1))
-    audio_mask = np.repeat(audio_mask, samples_per_window)
-
-    return wav[audio_mask == True]
-
 
 class Recorder(QObject):
     """docstring for Recorder"""
 
+    takeProcessed = Signal(str, bool, arguments=["filename", "ok"])
+    previewReady = Signal(str, str, arguments=["filename", "url"])
+    playbackReady = Signal(str, str, arguments=["filename", "url"])
+
     def __init__(
         self,
         save_dir,
@@ -89,12 +46,27 @@ class Recorder(QObject):
         ordered=False,
         prompts_count=100,
         prompt_len_soft_max=None,
+        workers=2,
+        stream_trim=False,
+        store="tsv",
+        preroll_ms=300,
+        qc_sort=None,
+        qc_worst=None,
+        station=None,
+        codec="flac",
+        source=None,
+        metrics_file=None,
+        metrics_interval=10,
     ):
         super(Recorder, self).__init__()
+        if station:
+            # Each station records into a shard of its own, combined afterwards by merge.py
+            save_dir = os.path.join(save_dir, manifest.STATIONS_DIR, station)
         Utils.create_dir(save_dir)
         if not os.path.isdir(save_dir):
             raise Exception("save_dir '%s' is not a directory" % save_dir)
         self.save_dir = save_dir
+        self.station_lock = manifest.StationLock(save_dir) if station else None
         if not os.path.isfile(prompts_filename):
             raise Exception("prompts_filename '%s' is not a file" % prompts_filename)
         self.prompts_filename = prompts_filename
@@ -111,18 +83,64 @@ class Recorder(QObject):
         self.prompts_count = prompts_count
         self.prompt_len_soft_max = prompt_len_soft_max
         self.ordered = ordered if isinstance(ordered, bool) else eval(ordered)
-        self.audio = audio.Audio()
+        self.stream_trim = (
+            stream_trim if isinstance(stream_trim, bool) else eval(stream_trim)
+        )
+        self.start_latencies = collections.deque(maxlen=100)
+        # Stage latencies and capture stats, written to metrics_file every metrics_interval seconds
+        self.telemetry = telemetry.Telemetry(metrics_file, metrics_interval)
+        if self.stream_trim:
+            # VAD runs in the capture callback, only trimmed audio is kept
+            self.trimmer = trimming.StreamingTrimmer(
+                block_ms=1000 // audio.Audio.BLOCKS_PER_SECOND, drop_last=3
+            )
+            self.audio = audio.Audio(
+                callback=self.trimmer.feed,
+                gated=True,
+                latency_callback=self.on_start_latency,
+                source=source,
+                telemetry=self.telemetry,
+            )
+        else:
+            # Blocks are written straight into one growable buffer per take
+            self.capture = audio.CaptureBuffer(
+                preroll_ms=preroll_ms, telemetry=self.telemetry
+            )
+            self.audio = audio.Audio(
+                callback=self.capture.write,
+                idle_callback=self.capture.write_preroll,
+                gated=True,
+                latency_callback=self.on_start_latency,
+                source=source,
+                telemetry=self.telemetry,
+            )
+        self.processor = processing.TakeProcessor(max_workers=workers)
+        self.codec = codec
+        # Quality metrics are a separate, lower priority stage with a single worker
+        self.qc_processor = processing.TakeProcessor(max_workers=1)
+        # Compressed takes are decoded to a WAV copy for playback off the GUI thread too
+        self.playback_processor = processing.TakeProcessor(max_workers=1)
+        self.qc_sort = qc_sort
+        self.qc_worst = qc_worst
+        self.prompt_totals = collections.Counter()
+        self.prompt_remaining = collections.Counter()
+        self.store = manifest.STORES[store](save_dir)
+        self.previews = None
         self.scripts = None
+        self._scriptModel = script_model.ScriptModel(self)
         # self.setWindowTitle("Title of window")
         # self.title = "Title of window"
         # self.setProperty("title", "self.save_dir")
 
-    @Slot(QObject)
-    def init(self, scriptModel):
-        logging.debug("init: %s", scriptModel)
+    def get_script_model(self):
+        return self._scriptModel
+
+    scriptModel = Property(QObject, get_script_model, constant=True)
+
+    @Slot()
+    def init(self):
         self.window.setProperty("validation", self.validation)
         self.window.setProperty("saveDir", self.save_dir)
-        self.scriptModel = scriptModel
         self.window.setProperty(
             "promptsName",
             self.prompt_name.capitalize(),
@@ -134,70 +152,77 @@ class Recorder(QObject):
         )
 
         prompt_name = self.get_prompt_name()
-        recording_filename = os.path.normpath(
-            os.path.join(self.window.property("saveDir"), prompt_name, "recorder.tsv")
-        )
 
+        # The whole list goes into the model in one reset, rather than one QML call per prompt
         if not self.validation:
             if not self.reload_scripts:
-                for script in self.get_scripts_from_file(
-                    self.prompts_count,
-                    self.prompts_filename,
-                    self.ordered,
-                    split_len=self.prompt_len_soft_max,
-                ):
-                    self.window.appendScript({"script": script, "filename": ""})
+                self.scriptModel.reset(
+                    (script, "")
+                    for script in self.get_scripts_from_file(
+                        self.prompts_count,
+                        self.prompts_filename,
+                        self.ordered,
+                        split_len=self.prompt_len_soft_max,
+                    )
+                )
             else:
-                for (
-                    filename,
-                    prompt_category,
-                    prompt,
-                ) in self.reload_scripts_from_files(
-                    self.prompts_count,
-                    self.prompts_filename,
-                    recording_filename,
-                    self.ordered,
-                    split_len=self.prompt_len_soft_max,
-                ):
-                    self.window.appendScript({"script": prompt, "filename": filename})
+                self.scriptModel.reset(
+                    (prompt, filename)
+                    for filename, prompt_category, prompt in self.reload_scripts_from_files(
+                        self.prompts_count,
+                        self.prompts_filename,
+                        prompt_name,
+                        self.ordered,
+                        split_len=self.prompt_len_soft_max,
+                    )
+                )
 
         else:
-            prompt_name = self.get_prompt_name()
-            filename = os.path.normpath(
-                os.path.join(
-                    self.window.property("saveDir"), prompt_name, "recorder.tsv"
-                )
+            self.scriptModel.reset(
+                (
+                    (prompt, filename)
+                    for filename, prompt_category, prompt in self.get_scripts_from_recording_file(
+                        self.prompts_count,
+                        prompt_name,
+                        self.ordered,
+                        split_len=self.prompt_len_soft_max,
+                    )
+                ),
+                metrics=self.store.metrics(),
             )
 
-            for (
-                filename,
-                prompt_category,
-                prompt,
-            ) in self.get_scripts_from_recording_file(
-                self.prompts_count,
-                filename,
-                self.ordered,
-                split_len=self.prompt_len_soft_max,
-            ):
-                self.window.appendScript({"script": prompt, "filename": filename})
-
     @Slot(bool)
     def toggleRecording(self, recording):
         logging.debug("toggleRecording: recording is now %s", recording)
 
     @Slot()
     def startRecording(self):
-        size = self.flush()
-        logging.debug("flushed %s", size)
-        self.audio.stream.start_stream()
+        # The stream stays open for the whole session, only the gate is toggled
+        with self.telemetry.stage("start"):
+            if self.stream_trim:
+                self.audio.open_gate(before=self.trimmer.reset)
+            else:
+                self.audio.open_gate(before=self.capture.start)
+
+    def on_start_latency(self, latency):
+        # Called from the stream callback, on the first block after startRecording
+        self.start_latencies.append(latency)
+        self.telemetry.observe("start.first_block", latency)
+        logging.debug("start to first captured sample: %.1f ms", latency * 1000)
 
     @Slot()
     def finishRecording(self):
+        stopped_at = time.perf_counter()
         self.no_of_recorded_prompts = self.no_of_recorded_prompts + 1
         self.setTitle(self.scripts)
 
-        self.audio.stream.stop_stream()
-        data = self.read_audio(drop_last=3)
+        with self.telemetry.stage("finish.close_gate"):
+            self.audio.close_gate()
+        with self.telemetry.stage("finish.read_audio"):
+            if self.stream_trim:
+                data = self.trimmer.finish()
+            else:
+                data = self.read_audio(drop_last=3)
 
         if self.window.property("scriptFilename"):
             self.deleteFile(self.window.property("scriptFilename"))
@@ -209,127 +234,256 @@ class Recorder(QObject):
         dirname = os.path.normpath(
             os.path.join(self.window.property("saveDir"), prompt_name)
         )
-        Utils.create_dir(dirname)
 
         filename = os.path.normpath(
             os.path.join(
                 dirname,
-                _filename + ".wav",
+                _filename + takefile.extension(self.codec),
             )
         )
 
         self.window.setProperty("scriptFilename", filename)
-        self.audio.write_wav(filename, data)
         scriptText = self.window.property("scriptText")
+        self.prompt_remaining[scriptText] -= 1
+        self.update_prompt_progress()
+        prompt_category = self.window.property("promptsName").lower()
 
-        self.saveFile(
-            dirname=self.window.property("saveDir"),
+        # Writing, manifest appends and trimming run on the worker pool
+        self.window.setProperty(
+            "pendingTakes", self.window.property("pendingTakes") + 1
+        )
+        future = self.processor.submit(
+            filename,
+            self.process_take,
+            data=data,
+            prompt_name=prompt_name,
+            dirname=dirname,
             filename=filename,
             scriptText=scriptText,
+            prompt_category=prompt_category,
+            trimmed=self.stream_trim,
+            stopped_at=stopped_at,
         )
-        self.saveFile(dirname=dirname, filename=filename, scriptText=scriptText)
+        future.add_done_callback(lambda f: self.on_take_processed(filename, f))
+        self.telemetry.gauge("take.pending", len(self.processor))
+        self.qc_processor.submit(
+            filename, self.measure_take, data=data, filename=filename
+        )
+        # Time from the stop press until the UI is ready for the next take
+        self.telemetry.observe("finish", time.perf_counter() - stopped_at)
+
+    def on_take_processed(self, filename, future):
+        # Called on the worker thread once the take's job is done, cancelled or failed
+        self.telemetry.gauge("take.pending", len(self.processor))
+        self.takeProcessed.emit(
+            filename, not future.cancelled() and future.exception() is None
+        )
+
+    def process_take(
+        self,
+        data,
+        prompt_name,
+        dirname,
+        filename,
+        scriptText,
+        prompt_category,
+        trimmed=False,
+        stopped_at=None,
+    ):
+        if stopped_at is not None:
+            self.telemetry.observe("take.queue_wait", time.perf_counter() - stopped_at)
+        Utils.create_dir(dirname)
 
-        logging.debug("wrote %s to %s", len(data), filename)
+        # trim silence? Done on the captured int16 samples, so the take is written once
+        if not trimmed:
+            try:
+                with self.telemetry.stage("take.trim"):
+                    pcm = np.frombuffer(data, dtype=np.int16)
+                    data = [pcm[start:end] for start, end in trimming.trim_spans(pcm)]
+            except Exception as e:
+                print(f"Error : {e}")
+        # Encoded here on the worker pool; FLAC/Opus cut disk and transfer size
+        with self.telemetry.stage("take.write"):
+            takefile.write(
+                filename, data, codec=self.codec, sample_rate=self.audio.sample_rate
+            )
 
-        trimmed_filename = os.path.normpath(
-            os.path.join(
-                dirname,
-                _filename + "_trimmed" + ".wav",
+        with self.telemetry.stage("take.manifest"):
+            self.saveFile(
+                prompt_name=prompt_name,
+                filename=filename,
+                scriptText=scriptText,
+                prompt_category=prompt_category,
+            )
+        if stopped_at is not None:
+            self.telemetry.observe("take.saved", time.perf_counter() - stopped_at)
+
+        logging.debug("wrote %s", filename)
+
+    def measure_take(self, data, filename):
+        # On the capture before trimming, so silences and the cut at the end are still there. With stream_trim
+        # only the trimmed take exists: little silence is left to estimate the noise floor (snr_db) from
+        with self.telemetry.stage("qc.measure"):
+            metrics = qc.take_metrics(np.frombuffer(data, dtype=np.int16))
+        with self.telemetry.stage("qc.manifest"):
+            self.store.add_metrics(filename, metrics)
+        logging.debug("measured %s: %s", filename, metrics)
+
+    @Slot(str)
+    def requestPreview(self, filename):
+        """Render (or fetch from the cache) the waveform/spectrogram preview of a take; `previewReady` fires when done."""
+        if not filename or not os.path.isfile(filename):
+            return
+        if self.previews is None:
+            self.previews = spectrogram.SpectrogramService(
+                os.path.join(self.save_dir, ".previews")
+            )
+
+        def on_done(future):
+            if future.exception() is not None:
+                logging.debug("preview of %s failed: %s", filename, future.exception())
+                return
+            self.previewReady.emit(
+                filename,
+                QUrl.fromLocalFile(os.path.abspath(future.result())).toString(),
             )
+
+        self.previews.request(filename).add_done_callback(on_done)
+
+    def playable(self, filename):
+        # A take is written by the worker pool after finishRecording returns
+        return (
+            filename
+            and not self.processor.pending(filename)
+            and os.path.isfile(filename)
         )
 
-        # trim silence?
-        try:
-            wav, source_sr = Utils.load_wav_file(_wav_file_=filename)
-            wav = trim_long_silences(wav)
-            soundfile.write(str(filename), wav, source_sr)
-        except Exception as e:
-            print(f"Error : {e}")
+    @Slot(str, result=str)
+    def playbackUrl(self, filename):
+        """URL to play a take from, or "" if it is not ready: still being written, or not decoded yet.
+
+        A compressed take is decoded to a WAV copy in the background, and `playbackReady` fires once it is.
+        """
+        if not self.playable(filename):
+            return ""
+        cache_dir = os.path.join(self.save_dir, ".playback")
+        path = takefile.cached_wav(filename, cache_dir)
+        if path is None:
+            if not self.playback_processor.pending(filename):
+                future = self.playback_processor.submit(
+                    filename, takefile.decode_to_wav, filename, cache_dir
+                )
+                future.add_done_callback(
+                    lambda f: self.on_playback_decoded(filename, f)
+                )
+            return ""
+        return QUrl.fromLocalFile(os.path.abspath(path)).toString()
+
+    def on_playback_decoded(self, filename, future):
+        if future.cancelled() or future.exception() is not None:
+            logging.warning(
+                "could not decode %s for playback: %s",
+                filename,
+                None if future.cancelled() else future.exception(),
+            )
+            return
+        self.playbackReady.emit(
+            filename, QUrl.fromLocalFile(os.path.abspath(future.result())).toString()
+        )
 
     @Slot(str)
     def playFile(self, filename):
-        winsound.PlaySound(filename, winsound.SND_FILENAME)
-
-    def saveFile(self, dirname, filename, scriptText):
-        with open(os.path.join(dirname, "recorder.tsv"), "a") as xsvfile:
-            xsvfile.write(
-                "\t".join(
-                    [
-                        filename,
-                        "0",
-                        self.window.property("promptsName").lower(),
-                        "",
-                        self.sanitize_script(scriptText),
-                    ]
-                )
-                + "\n"
+        if not self.playable(filename):
+            return
+
+        def play():
+            path = takefile.decode_to_wav(
+                filename, os.path.join(self.save_dir, ".playback")
             )
+            winsound.PlaySound(path, winsound.SND_FILENAME)
+
+        self.playback_processor.submit(filename, play)
+
+    def saveFile(self, prompt_name, filename, scriptText, prompt_category=None):
+        if prompt_category is None:
+            prompt_category = self.window.property("promptsName").lower()
+        self.store.add(
+            prompt_name,
+            [
+                filename,
+                "0",
+                prompt_category,
+                "",
+                self.sanitize_script(scriptText),
+            ],
+        )
 
     def get_prompt_name(self):
-        prompt_name = (self.prompts_filename.split("/")[1]).split(".")[0]
-        return prompt_name
+        return self.prompt_name
 
     @Slot(str)
     def deleteFile(self, filename):
+        with self.telemetry.stage("delete"):
+            self._delete_file(filename)
+
+    def _delete_file(self, filename):
         self.no_of_recorded_prompts = self.no_of_recorded_prompts - 1
         self.setTitle(self.scripts)
 
-        prompt_name = (self.prompts_filename.split("/")[1]).split(".")[0]
-        dirname = os.path.normpath(
-            os.path.join(self.window.property("saveDir"), prompt_name)
+        prompt_name = self.get_prompt_name()
+        self.window.setProperty("scriptFilename", "")
+        self.prompt_remaining[self.window.property("scriptText")] += 1
+        self.update_prompt_progress()
+
+        # A take still waiting in the pool is dropped before it reaches the disk
+        if self.processor.cancel(filename):
+            logging.debug("cancelled pending processing of %s", filename)
+        if not self.qc_processor.cancel(filename) and self.qc_processor.pending(
+            filename
+        ):
+            # Already being measured: drop its metrics once they are added, which deleteTranscript cannot order
+            self.qc_processor.submit(filename, self.store.remove_metrics, filename)
+        self.processor.submit(
+            filename, self.deleteTranscript, prompt_name=prompt_name, filename=filename
         )
 
-        self.deleteTranscript(
-            dirname=self.window.property("saveDir"), filename=filename
-        )
-        self.deleteTranscript(dirname=dirname, filename=filename)
-
-    def deleteTranscript(self, dirname, filename):
-        Utils.delete_file(filename)
-        xsvfile_in_path = os.path.join(dirname, "recorder.tsv")
-        xsvfile_out_path = os.path.join(dirname, "recorder_delete_temp.tsv")
-        with open(xsvfile_in_path, "r") as xsvfile_in:
-            with open(xsvfile_out_path, "w") as xsvfile_out:
-                for line in xsvfile_in:
-                    if filename not in line:
-                        xsvfile_out.write(line)
-        os.replace(xsvfile_out_path, xsvfile_in_path)
-        self.window.setProperty("scriptFilename", "")
+    def deleteTranscript(self, prompt_name, filename):
+        with self.telemetry.stage("delete.file"):
+            Utils.delete_file(filename)
+        with self.telemetry.stage("delete.manifest"):
+            self.store.remove(prompt_name, filename)
 
     def read_audio(self, drop_last=None):
-        blocks = []
-        while not self.audio.buffer_queue.empty():
-            block = self.audio.buffer_queue.get_nowait()
-            # logging.debug('read %s', len(block) if block else None)
-            if block:
-                blocks.append(block)
-        # logging.debug('read total %s', len(b''.join(blocks)))
-        if drop_last:
-            blocks = blocks[:-drop_last]
-        return b"".join(blocks)
+        return self.capture.take(drop_last=drop_last)
 
     def flush(self):
-        size = self.audio.buffer_queue.qsize()
-        while not self.audio.buffer_queue.empty():
-            self.audio.buffer_queue.get_nowait()
-        return size
+        return self.capture.clear()
 
     def reload_scripts_from_files(
-        self, n, filename, recording_filename, ordered=False, split_len=None
+        self, n, filename, prompt_name, ordered=False, split_len=None
     ):
         # TODO: Delete output folder Run Reload and there  is error in recordings
         # also show 1/10 recording indicators on UI
         file_scripts = self.get_scripts_from_file(n, filename, ordered, split_len)
 
         recording_file_scripts = self.get_scripts_from_recording_file(
-            n, recording_filename, ordered, split_len
+            n, prompt_name, ordered, split_len
         )
         self.no_of_recorded_prompts = len(recording_file_scripts)
 
         result_scripts = recording_file_scripts
-        for script in recording_file_scripts:
-            if script[2] in file_scripts:
-                file_scripts.remove(script[2])
+        file_scripts = prompt_loader.reconcile(
+            file_scripts, [script[2] for script in recording_file_scripts]
+        )
+        self.prompt_remaining = collections.Counter(file_scripts)
+        logging.info(
+            "%s of %s prompts fully recorded, %s takes to go",
+            sum(
+                1 for prompt in self.prompt_totals if not self.prompt_remaining[prompt]
+            ),
+            len(self.prompt_totals),
+            len(file_scripts),
+        )
 
         file_scripts_tuples = [("", self.prompt_name, label) for label in file_scripts]
         result_scripts.extend(file_scripts_tuples)
@@ -339,37 +493,49 @@ class Recorder(QObject):
 
         return result_scripts
 
+    @Slot(str, result=str)
+    def promptProgress(self, script):
+        total = self.prompt_totals[script]
+        if not total:
+            return ""
+        recorded = min(max(total - self.prompt_remaining[script], 0), total)
+        return "%d of %d takes of this prompt recorded" % (recorded, total)
+
+    def update_prompt_progress(self):
+        # The QML only asks when the selection changes, so refresh it whenever the selected prompt's count does
+        self.window.setProperty(
+            "promptProgress", self.promptProgress(self.window.property("scriptText"))
+        )
+
     def get_scripts_from_file(self, n, filename, ordered=False, split_len=None):
-        def filter(script):
-            # match = re.fullmatch(r'\w+ "(.*)"', script)
-            patterns = [
-                r'^\w+ "(.*)"$',  # arctic
-                r"^(.*) \(s.\d+\)$",  # timit
-            ]
-            for pat in patterns:
-                script = re.sub(pat, r"\1", script, count=1)
-            return script
-
-        with open(filename, "r") as file:
-            scripts = [line.strip() for line in file if not line.startswith(";")]
+        # Parsed once per distinct prompt, and cached per prompt file content
+        pairs = prompt_loader.load_prompts(
+            filename, cache_dir=os.path.join(self.save_dir, ".prompts_cache")
+        )
 
         if IS_SHUFFLE:
+            scripts = [prompt for line, prompt in pairs]
             if n is None:
                 n = len(scripts)
             if not ordered:
                 random.shuffle(scripts)
                 scripts = [random.choice(scripts) for _ in range(n)]
             scripts = scripts[:n]
+            repeat = 1
         else:
-            n = self.no_of_samples_per_prompt
+            repeat = self.no_of_samples_per_prompt
             if ordered:
-                scripts.sort(reverse=False)
-            scripts = [item for item in scripts for _ in range(n)]
+                pairs = sorted(pairs)
+            scripts = [prompt for line, prompt in pairs]
 
-        scripts = [filter(script) for script in scripts]
         if split_len is not None:
-            scripts = [self.split_script(script, split_len) for script in scripts]
-            scripts = sum(scripts, [])
+            pieces = [self.split_script(script, split_len) for script in scripts]
+        else:
+            pieces = [[script] for script in scripts]
+        scripts = [piece for split in pieces for _ in range(repeat) for piece in split]
+        # Takes still to record per prompt, updated as takes are recorded and deleted
+        self.prompt_totals = collections.Counter(scripts)
+        self.prompt_remaining = collections.Counter(scripts)
 
         self.setTitle(scripts)
 
@@ -383,33 +549,33 @@ class Recorder(QObject):
             scripts.sort(reverse=False, key=sortFunc)
 
     def get_scripts_from_recording_file(
-        self, n, filename, ordered=False, split_len=None
+        self, n, prompt_name, ordered=False, split_len=None
     ):
-        def split(script):
-            split = script.split("\t")
-            filename = split[0]
-            prompt_category_prefix = split[1]
-            prompt_category = split[2]
-            prompt_prefix = split[3]
-            prompt = split[4]
+        def split(fields):
+            filename = fields[0]
+            prompt_category_prefix = fields[1]
+            prompt_category = fields[2]
+            prompt_prefix = fields[3]
+            prompt = fields[4]
 
             return (filename, prompt_category, prompt)
 
-        scripts = []
-        if Utils.is_path_exists(filename):
-            with open(filename, "r") as file:
-                scripts = [line.strip() for line in file if not line.startswith(";")]
-
-                # if IS_SHUFFLE:
-                #     if n is None:
-                #         n = len(scripts)
-                #     if not ordered:
-                #         random.shuffle(scripts)
-                #         scripts = [random.choice(scripts) for _ in range(n)]
-                #     scripts = scripts[:n]
-                # else:
-                scripts = [split(script) for script in scripts]
-                self.sort_scripts(scripts, ordered)
+        scripts = self.store.scripts(prompt_name)
+
+        # if IS_SHUFFLE:
+        #     if n is None:
+        #         n = len(scripts)
+        #     if not ordered:
+        #         random.shuffle(scripts)
+        #         scripts = [random.choice(scripts) for _ in range(n)]
+        #     scripts = scripts[:n]
+        # else:
+        scripts = [split(script) for script in scripts]
+        self.sort_scripts(scripts, ordered)
+        if self.validation and self.qc_sort:
+            scripts = qc.worst_first(
+                scripts, self.store.metrics(), self.qc_sort, self.qc_worst
+            )
 
         self.no_of_recorded_prompts = len(scripts)
 
@@ -523,6 +689,71 @@ def main():
         default=True,
         help="present prompts in order, as opposed to random (default: %(default)s)",
     )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=2,
+        help="background threads processing finished takes (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-t",
+        "--stream_trim",
+        default=False,
+        help="trim silences while recording instead of after each take; quality metrics are then measured on the trimmed take (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-s",
+        "--store",
+        choices=sorted(manifest.STORES),
+        default="tsv",
+        help="where takes are recorded: recorder.tsv files, or one recorder.sqlite "
+        "database exported with `manifest.py -s sqlite` (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-b",
+        "--preroll_ms",
+        type=int,
+        default=300,
+        help="audio from before Start is pressed to include in each take (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-q",
+        "--qc_sort",
+        choices=sorted(qc.METRICS),
+        help="in validation mode, list takes worst first by this quality metric",
+    )
+    parser.add_argument(
+        "-k",
+        "--qc_worst",
+        type=float,
+        help="with --qc_sort, only list this percentage of takes, e.g. 5 for the worst 5%%",
+    )
+    parser.add_argument(
+        "-m",
+        "--station",
+        help="record into save_dir/stations/STATION, so several stations can share one "
+        "save_dir; combine them with `merge.py save_dir`",
+    )
+    parser.add_argument(
+        "-f",
+        "--codec",
+        choices=sorted(takefile.CODECS),
+        default="flac",
+        help="how takes are stored: lossless FLAC, lossy Opus or plain WAV (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-x",
+        "--metrics_file",
+        help="periodically write per-stage latency histograms and capture stats here, "
+        "as Prometheus text if it ends in .prom, JSON otherwise",
+    )
+    parser.add_argument(
+        "--metrics_interval",
+        type=float,
+        default=10,
+        help="seconds between writes of --metrics_file (default: %(default)s)",
+    )
     args = parser.parse_args()
     assert args.prompts_filename
 
@@ -530,10 +761,14 @@ def main():
     app = QGuiApplication(sys.argv)
     engine = QQmlApplicationEngine()
     engine.addImportPath(current_path)
+    optional_args = (
+        "prompts_count prompt_len_soft_max workers stream_trim store preroll_ms "
+        "qc_sort qc_worst station codec metrics_file metrics_interval"
+    )
     kwargs = {
         k: v
         for k, v in vars(args).items()
-        if v is not None and k in "prompts_count prompt_len_soft_max".split()
+        if v is not None and k in optional_args.split()
     }
 
     recorder = Recorder(
@@ -550,6 +785,16 @@ def main():
     recorder.window = engine.rootObjects()[0]
 
     res = app.exec_()
+    recorder.audio.destroy()
+    recorder.processor.shutdown(wait=True)
+    recorder.qc_processor.shutdown(wait=True)
+    recorder.playback_processor.shutdown(wait=False)
+    if recorder.previews is not None:
+        recorder.previews.shutdown(wait=False)
+    recorder.store.close()
+    recorder.telemetry.close()
+    if recorder.station_lock is not None:
+        recorder.station_lock.release()
     sys.exit(res)
 
 
@@ -18,37 +18,73 @@ Window {
     property string scriptText: ''
     property string scriptFilename: ''
     property string saveDir: '.'
+    property int pendingTakes: 0
+    property string promptProgress: ''
+    property string playWhenReady: ''
 
     Component.onCompleted: initTimer.start()
     Timer {
         id: initTimer
         interval: 0
-        onTriggered: recorder.init(scriptModel)
+        onTriggered: {
+            recorder.init();
+            // A model reset, unlike appending, does not select the first row
+            if (scriptListView.count > 0) scriptListView.currentIndex = 0;
+        }
     }
 
     onRecordingChanged: recorder.toggleRecording(recording)
-    onScriptFilenameChanged: scriptModel.get(scriptListView.currentIndex).filename = scriptFilename
-
-    function appendScript(data) {
-        scriptModel.append(data)
-    }
+    onScriptFilenameChanged: recorder.scriptModel.setFilename(scriptListView.currentIndex, scriptFilename)
 
     function gotoPreviousScript() {
         scriptListView.decrementCurrentIndex();
         scriptListView.positionViewAtIndex(scriptListView.currentIndex, ListView.Center);
     }
 
+    function requestPreviews() {
+        // The neighbours too, so moving through the list finds them already rendered
+        for (var i = scriptListView.currentIndex - 1; i <= scriptListView.currentIndex + 1; i++) {
+            if (i >= 0 && i < scriptListView.count) recorder.requestPreview(recorder.scriptModel.filename(i));
+        }
+    }
+
     function gotoNextScript() {
         scriptListView.incrementCurrentIndex();
         scriptListView.positionViewAtIndex(scriptListView.currentIndex, ListView.Center);
     }
 
+    function playTake(filename) {
+        // Empty until the take is written and, if compressed, decoded; onTakeProcessed/onPlaybackReady retry
+        var url = recorder.playbackUrl(filename);
+        playWhenReady = url ? '' : filename;
+        if (url) {
+            playFile.source = url;
+            playFile.play();
+        }
+    }
+
     function setTitle() {
         title: qsTr("Validator")
     }
 
-    ListModel {
-        id: scriptModel
+    Connections {
+        target: recorder
+        onTakeProcessed: {
+            pendingTakes -= 1;
+            if (!ok) console.log('processing failed or cancelled: ' + filename);
+            else if (validation && filename == scriptFilename) recorder.requestPreview(filename);
+            if (ok && filename == playWhenReady) playTake(filename);
+        }
+        onPlaybackReady: {
+            if (filename == playWhenReady) {
+                playWhenReady = '';
+                playFile.source = url;
+                playFile.play();
+            }
+        }
+        onPreviewReady: {
+            if (filename == scriptFilename) preview.source = url;
+        }
     }
 
     ColumnLayout {
@@ -62,7 +98,7 @@ Window {
 
             ListView {
                 id: scriptListView
-                model: scriptModel
+                model: recorder.scriptModel
                 anchors.fill: parent
                 focus: true
                 clip: true
@@ -70,14 +106,17 @@ Window {
                 highlight: Rectangle { color: "lightsteelblue"; radius: 5 }
 
                 onCurrentItemChanged: {
-                    scriptText = model.get(currentIndex).script;
-                    scriptFilename = model.get(currentIndex).filename;
+                    scriptText = recorder.scriptModel.script(currentIndex);
+                    scriptFilename = recorder.scriptModel.filename(currentIndex);
                     console.log('selected: "' + scriptText + '", ' + scriptFilename);
+                    preview.source = '';
+                    promptProgress = recorder.promptProgress(scriptText);
+                    if (validation) requestPreviews();
                 }
 
                 delegate: Item {
                     width: parent.width - 20
-                    height: 30
+                    height: metrics ? 42 : 30
                     Column {
                         Text {
                             text: script
@@ -87,6 +126,11 @@ Window {
                             text: 'Filename: ' + filename
                             font.pointSize: 8
                         }
+                        Text {
+                            visible: metrics != ''
+                            text: metrics
+                            font.pointSize: 8
+                        }
                     }
                     MouseArea {
                         anchors.fill: parent
@@ -106,6 +150,33 @@ Window {
             text: validation ? "Validation View -> " + promptTitle : "Recording View -> " + promptTitle
         }
 
+        Label {
+            Layout.fillWidth: true
+            visible: pendingTakes > 0
+            color: "#fff"
+            font.pointSize: 10
+            text: "Processing " + pendingTakes + (pendingTakes == 1 ? " take..." : " takes...")
+        }
+
+        Image {
+            id: preview
+            Layout.fillWidth: true
+            Layout.preferredHeight: 94
+            visible: validation
+            fillMode: Image.Stretch
+            asynchronous: true
+            cache: false
+            source: ''
+        }
+
+        Label {
+            Layout.fillWidth: true
+            visible: !validation && promptProgress != ''
+            color: "#fff"
+            font.pointSize: 10
+            text: promptProgress
+        }
+
         CheckBox {
             Layout.fillWidth: true
             font.pointSize: 14
@@ -153,10 +224,7 @@ Window {
                 enabled: scriptFilename
                 highlighted: playFile.playbackState == playFile.PlayingState
                 // onClicked: recorder.playFile(scriptFilename)
-                onClicked: {
-                    playFile.source = scriptFilename
-                    playFile.play()
-                }
+                onClicked: playTake(scriptFilename)
                 Audio {
                     id: playFile
                     source: ''
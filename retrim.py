@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+import argparse, json, logging, os, sys, time
+from concurrent.futures import ProcessPoolExecutor
+
+import manifest
+import takefile
+import trimming
+
+CACHE_FILENAME = "retrim_cache.json"
+# With --in_place, the untrimmed takes are kept here (under save_dir) and every run trims from them
+ORIGINALS_DIR = ".retrim_originals"
+
+
+def write_wav_atomic(path, pcm, rate):
+    """Write through a temporary file in the same directory, so readers never see a partial take.
+
+    The take keeps its codec (taken from the extension of `path`).
+    """
+    tmp_path = path + ".tmp"
+    takefile.write(
+        tmp_path, pcm.tobytes(), codec=takefile.codec_of(path), sample_rate=rate
+    )
+    os.replace(tmp_path, path)
+
+
+def corpus_path(take, save_dir):
+    """Path of a take relative to save_dir's parent, for mirroring it under another directory."""
+    path = os.path.relpath(
+        os.path.abspath(take), os.path.dirname(os.path.abspath(save_dir))
+    )
+    if path.split(os.sep)[0] == os.pardir:
+        # Recorded somewhere else altogether: mirror its absolute path
+        path = os.path.splitdrive(os.path.abspath(take))[1].lstrip(os.sep)
+    return path
+
+
+def file_stat(path):
+    """Size and modification time of a file, which stand in for its content in the cache."""
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def process_file(job):
+    """Trim `src` into `dst`. Runs in a worker process; returns `(dst, input stat, output stat, input seconds, error)`.
+
+    When `src` does not exist yet (the first in-place run over a take), the untrimmed take at `dst` is moved
+    there first.
+    """
+    src, dst, params = job
+    try:
+        if not os.path.isfile(src):
+            os.makedirs(os.path.dirname(src), exist_ok=True)
+            os.replace(dst, src)
+        pcm, rate = takefile.read(src)
+        trimmed = trimming.trim_long_silences(pcm, rate=rate, **params)
+        dirname = os.path.dirname(dst)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname, exist_ok=True)
+        write_wav_atomic(dst, trimmed, rate)
+        return dst, file_stat(src), file_stat(dst), len(pcm) / float(rate), None
+    except Exception as e:
+        return dst, None, None, 0.0, "%s: %s" % (e.__class__.__name__, e)
+
+
+def load_cache(path):
+    if os.path.exists(path):
+        with open(path, "r") as file:
+            return json.load(file)
+    return {}
+
+
+def save_cache(path, cache):
+    with open(path + ".tmp", "w") as file:
+        json.dump(cache, file, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="""
+        Re-trim long silences from every take listed in a save_dir manifest, in parallel
+        across all cores. Takes whose content and trimming parameters are unchanged since
+        the last run are skipped. Trimmed takes go to a new directory (-o), or replace the
+        takes with --in_place, which keeps the untrimmed takes in save_dir/.retrim_originals
+        so that later runs with other settings still trim from the original audio.
+    """)
+    parser.add_argument("save_dir", help="directory containing recorder.tsv")
+    parser.add_argument(
+        "-o",
+        "--output_dir",
+        help="write trimmed takes under this directory",
+    )
+    parser.add_argument(
+        "--in_place",
+        action="store_true",
+        help="replace the takes, keeping the untrimmed ones in save_dir/.retrim_originals",
+    )
+    parser.add_argument("-s", "--store", choices=sorted(manifest.STORES), default="tsv")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="worker processes (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--vad_window_length", type=int, default=trimming.vad_window_length
+    )
+    parser.add_argument(
+        "--vad_moving_average_width",
+        type=int,
+        default=trimming.vad_moving_average_width,
+    )
+    parser.add_argument(
+        "--vad_max_silence_length", type=int, default=trimming.vad_max_silence_length
+    )
+    args = parser.parse_args()
+    if bool(args.output_dir) == args.in_place:
+        parser.error("give either -o/--output_dir or --in_place")
+
+    params = {
+        "window_length": args.vad_window_length,
+        "width": args.vad_moving_average_width,
+        "max_silence": args.vad_max_silence_length,
+    }
+    params_key = json.dumps(params, sort_keys=True)
+    cache_path = os.path.join(args.output_dir or args.save_dir, CACHE_FILENAME)
+    cache = load_cache(cache_path)
+
+    store = manifest.STORES[args.store](args.save_dir)
+    jobs, skipped, missing = [], 0, 0
+    for fields in store.scripts():
+        take = takefile.resolve(fields[0], args.save_dir)
+        if args.output_dir:
+            src = take
+            dst = os.path.join(args.output_dir, corpus_path(take, args.save_dir))
+        else:
+            src = os.path.join(
+                args.save_dir, ORIGINALS_DIR, corpus_path(take, args.save_dir)
+            )
+            dst = take
+        if not os.path.isfile(src) and not (args.in_place and os.path.isfile(dst)):
+            missing += 1
+            continue
+        entry = cache.get(dst)
+        if (
+            entry
+            and entry["params"] == params_key
+            and os.path.isfile(src)
+            and os.path.isfile(dst)
+            and entry.get("input") == file_stat(src)
+            and entry.get("output") == file_stat(dst)
+        ):
+            skipped += 1
+            continue
+        jobs.append((src, dst, params))
+    store.close()
+
+    start = time.perf_counter()
+    done, failed, audio_s = 0, 0, 0.0
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        for dst, input_stat, output_stat, seconds, error in executor.map(
+            process_file, jobs, chunksize=16
+        ):
+            if error:
+                failed += 1
+                logging.error("%s: %s", dst, error)
+                continue
+            done += 1
+            audio_s += seconds
+            cache[dst] = {
+                "params": params_key,
+                "input": input_stat,
+                "output": output_stat,
+            }
+    elapsed = time.perf_counter() - start
+    save_cache(cache_path, cache)
+
+    print(
+        "%d trimmed, %d unchanged, %d failed, %d missing in %.1f s"
+        % (done, skipped, failed, missing, elapsed)
+    )
+    if done and elapsed > 0:
+        print(
+            "%.1f files/s, %.3f audio-hours/s"
+            % (done / elapsed, audio_s / 3600.0 / elapsed)
+        )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=20)
+    main()
@@ -0,0 +1,63 @@
+from PySide2.QtCore import QAbstractListModel, QModelIndex, Qt, Slot
+
+import qc
+
+
+class ScriptModel(QAbstractListModel):
+    """The prompt list shown by recorder.qml's ListView: rows of `(script, filename)`.
+
+    Rows are replaced all at once with `reset()`, a single model reset however many there are, and the roles
+    are only looked up when the view asks for a visible row. The `metrics` role is formatted from the take's
+    quality metrics on demand.
+    """
+
+    ROLES = ("script", "filename", "metrics")
+    SCRIPT, FILENAME, METRICS = range(Qt.UserRole + 1, Qt.UserRole + 1 + len(ROLES))
+
+    def __init__(self, parent=None):
+        super(ScriptModel, self).__init__(parent)
+        self.rows = []
+        self.metrics = {}
+
+    def reset(self, rows, metrics=None):
+        """Replace every row with `rows` of `(script, filename)`; `metrics` maps filenames to their QC metrics."""
+        self.beginResetModel()
+        self.rows = [[script, filename] for script, filename in rows]
+        self.metrics = metrics or {}
+        self.endResetModel()
+
+    def roleNames(self):
+        return {
+            Qt.UserRole + 1 + i: role.encode() for i, role in enumerate(self.ROLES)
+        }
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or not 0 <= index.row() < len(self.rows):
+            return None
+        script, filename = self.rows[index.row()]
+        if role in (self.SCRIPT, Qt.DisplayRole):
+            return script
+        if role == self.FILENAME:
+            return filename
+        if role == self.METRICS:
+            return qc.describe(self.metrics.get(filename))
+        return None
+
+    @Slot(int, result=str)
+    def script(self, row):
+        return self.rows[row][0] if 0 <= row < len(self.rows) else ""
+
+    @Slot(int, result=str)
+    def filename(self, row):
+        return self.rows[row][1] if 0 <= row < len(self.rows) else ""
+
+    @Slot(int, str)
+    def setFilename(self, row, filename):
+        if not 0 <= row < len(self.rows) or self.rows[row][1] == filename:
+            return
+        self.rows[row][1] = filename
+        index = self.index(row, 0)
+        self.dataChanged.emit(index, index, [self.FILENAME, self.METRICS])
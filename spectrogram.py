@@ -0,0 +1,196 @@
+import hashlib, json, logging, os, struct, threading, zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import takefile
+
+
+def stft_power(samples, nfft=512, hop=128, window=None):
+    """Power spectrum of every `nfft` frame, `hop` apart, as one `(frames, nfft // 2 + 1)` array.
+
+    The frames are a strided view of `samples`, windowed and transformed in a single vectorized FFT call.
+    """
+    if window is None:
+        window = np.hanning(nfft).astype(np.float32)
+    if len(samples) < nfft:
+        return np.zeros((0, nfft // 2 + 1), dtype=np.float32)
+    frames = np.lib.stride_tricks.sliding_window_view(samples, nfft)[::hop]
+    spectrum = np.fft.rfft(frames * window, axis=-1)
+    return (spectrum.real**2 + spectrum.imag**2).astype(np.float32)
+
+
+def write_png(filename, pixels):
+    """Write an 8-bit RGB `(height, width, 3)` array as a PNG, without pulling in an imaging library."""
+    height, width, _ = pixels.shape
+    raw = np.zeros((height, 1 + width * 3), dtype=np.uint8)
+    raw[:, 1:] = pixels.reshape(height, width * 3)
+
+    def chunk(tag, data):
+        body = tag + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body))
+
+    png = (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw.tobytes(), 6))
+        + chunk(b"IEND", b"")
+    )
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, "wb") as file:
+        file.write(png)
+    os.replace(tmp_filename, filename)
+
+
+class SpectrogramService(object):
+    """Renders waveform + spectrogram previews of takes on a thread pool, cached on disk.
+
+    Each preview is a PNG in `cache_dir` named after the WAV's path, mtime, size and the rendering parameters, so a
+    re-recorded or re-trimmed take gets a fresh one. The cache is kept under `max_bytes` by evicting the least
+    recently used previews (access time is tracked through the PNG's mtime).
+    """
+
+    def __init__(
+        self,
+        cache_dir,
+        max_bytes=256 * 1024 * 1024,
+        workers=2,
+        width=800,
+        waveform_height=60,
+        spectrogram_height=128,
+        nfft=512,
+        hop=128,
+        chunk_s=30,
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.params = {
+            "width": width,
+            "waveform_height": waveform_height,
+            "spectrogram_height": spectrogram_height,
+            "nfft": nfft,
+            "hop": hop,
+        }
+        self.chunk_s = chunk_s
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="spectrogram"
+        )
+        self.lock = threading.Lock()
+        self.futures = {}
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def cache_path(self, wav_path):
+        stat = os.stat(wav_path)
+        key = json.dumps(
+            [os.path.abspath(wav_path), stat.st_mtime_ns, stat.st_size, self.params]
+        )
+        return os.path.join(
+            self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + ".png"
+        )
+
+    def request(self, wav_path):
+        """Return a future for the preview PNG path of `wav_path`, rendering it in the background if not cached."""
+        with self.lock:
+            future = self.futures.get(wav_path)
+            if future is None:
+                future = self.executor.submit(self.render_cached, wav_path)
+                self.futures[wav_path] = future
+                future.add_done_callback(lambda f: self._forget(wav_path, f))
+        return future
+
+    def _forget(self, wav_path, future):
+        with self.lock:
+            if self.futures.get(wav_path) is future:
+                del self.futures[wav_path]
+
+    def render_cached(self, wav_path):
+        png_path = self.cache_path(wav_path)
+        if os.path.exists(png_path):
+            os.utime(png_path)
+            return png_path
+        write_png(png_path, self.render(wav_path))
+        self.evict()
+        return png_path
+
+    def render(self, wav_path):
+        """Waveform envelope over a log-power spectrogram, as an RGB array."""
+        width = self.params["width"]
+        nfft, hop = self.params["nfft"], self.params["hop"]
+        wav = takefile.open_map(wav_path)
+
+        # Waveform: min/max envelope per pixel column, and STFT frames, both streamed chunk by chunk
+        columns = np.linspace(0, len(wav), width + 1).astype(np.int64)
+        low = np.zeros(width, dtype=np.float32)
+        high = np.zeros(width, dtype=np.float32)
+        powers = []
+        chunk_frames = max(nfft, int(self.chunk_s * wav.sample_rate) // hop * hop)
+        window = np.hanning(nfft).astype(np.float32)
+        for start, frames in wav.chunks(chunk_frames + nfft - hop, overlap=nfft - hop):
+            samples = wav.as_float(frames if wav.channels == 1 else frames.mean(axis=1))
+            powers.append(stft_power(samples, nfft, hop, window))
+            bounds = np.clip(columns - start, 0, len(samples))
+            # Columns with samples in this chunk are contiguous and the last one runs to its end
+            touched = np.flatnonzero(bounds[1:] > bounds[:-1])
+            if len(touched):
+                offsets = bounds[touched]
+                low[touched] = np.minimum(
+                    low[touched], np.minimum.reduceat(samples, offsets)
+                )
+                high[touched] = np.maximum(
+                    high[touched], np.maximum.reduceat(samples, offsets)
+                )
+
+        wave_height = self.params["waveform_height"]
+        rows = np.arange(wave_height, dtype=np.float32)[:, None]
+        top = (1 - high[None, :]) * (wave_height - 1) / 2
+        bottom = (1 - low[None, :]) * (wave_height - 1) / 2
+        waveform = np.where(
+            (rows >= np.floor(top)) & (rows <= np.ceil(bottom)), 255, 32
+        )
+        waveform = np.repeat(waveform[:, :, None], 3, axis=2).astype(np.uint8)
+
+        spec_height = self.params["spectrogram_height"]
+        power = np.concatenate(powers) if powers else np.zeros((0, nfft // 2 + 1))
+        if len(power):
+            # Resample to the image grid: time across, frequency up
+            time_index = np.linspace(0, len(power) - 1, width).astype(np.int64)
+            freq_index = np.linspace(power.shape[1] - 1, 0, spec_height).astype(
+                np.int64
+            )
+            db = 10 * np.log10(power[time_index][:, freq_index].T + 1e-10)
+            level = np.clip((db - (db.max() - 80)) / 80, 0, 1)
+        else:
+            level = np.zeros((spec_height, width))
+        # Dark blue -> red -> yellow
+        spectrogram = np.stack(
+            [
+                np.clip(level * 2, 0, 1),
+                np.clip(level * 2 - 1, 0, 1),
+                np.clip(0.4 - level, 0, 1),
+            ],
+            axis=2,
+        )
+        spectrogram = (spectrogram * 255).astype(np.uint8)
+        return np.concatenate([waveform, spectrogram], axis=0)
+
+    def evict(self):
+        """Delete the least recently used previews until the cache fits in `max_bytes`."""
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith(".png"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError as e:
+                logging.debug("could not evict %s: %s", path, e)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,139 @@
+import hashlib, os, wave
+
+import numpy as np
+
+from wavmap import WavMap
+
+# How takes are stored: codec -> (file extension, soundfile format, soundfile subtype)
+CODECS = {
+    "wav": (".wav", "WAV", "PCM_16"),
+    "flac": (".flac", "FLAC", "PCM_16"),
+    "opus": (".opus", "OGG", "OPUS"),
+}
+
+
+def extension(codec):
+    return CODECS[codec][0]
+
+
+def codec_of(filename):
+    """The codec of a take file, from its extension (anything unknown is read as WAV)."""
+    ext = os.path.splitext(filename)[1].lower()
+    for codec, (codec_ext, _, _) in CODECS.items():
+        if ext == codec_ext:
+            return codec
+    return "wav"
+
+
+def write_wav(filename, data, sample_rate=16000, channels=1):
+    """Write int16 PCM to `filename`. `data` is bytes-like, or a list of bytes-like chunks written back to back."""
+    # logging.info("write wav %s", filename)
+    wf = wave.open(filename, "wb")
+    wf.setnchannels(channels)
+    wf.setsampwidth(2)
+    wf.setframerate(sample_rate)
+    for chunk in data if isinstance(data, list) else [data]:
+        wf.writeframesraw(chunk)
+    wf.close()
+
+
+def write(filename, data, codec="wav", sample_rate=16000):
+    """Write a mono int16 take (bytes-like, or a list of chunks as for `write_wav`) in `codec`.
+
+    FLAC and Opus are encoded with soundfile, which is only imported when one of them is used.
+    """
+    if codec == "wav":
+        return write_wav(filename, data, sample_rate)
+    import soundfile
+
+    chunks = data if isinstance(data, list) else [data]
+    pcm = np.concatenate(
+        [np.frombuffer(chunk, dtype=np.int16) for chunk in chunks]
+        or [np.zeros(0, dtype=np.int16)]
+    )
+    _, file_format, subtype = CODECS[codec]
+    soundfile.write(filename, pcm, sample_rate, format=file_format, subtype=subtype)
+
+
+def read(filename):
+    """Return a take's mono int16 samples and sample rate, decoding FLAC and Opus."""
+    if codec_of(filename) == "wav":
+        with wave.open(filename, "rb") as wf:
+            assert wf.getsampwidth() == 2 and wf.getnchannels() == 1, filename
+            rate = wf.getframerate()
+            pcm = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+        return pcm, rate
+    if os.path.getsize(filename) == 0:
+        # libsndfile writes nothing at all for a FLAC/Opus take with no samples (everything trimmed away)
+        return np.zeros(0, dtype=np.int16), 16000
+    import soundfile
+
+    pcm, rate = soundfile.read(filename, dtype="int16", always_2d=True)
+    if pcm.shape[1] > 1:
+        pcm = pcm.mean(axis=1).astype(np.int16)[:, None]
+    return pcm[:, 0].copy(), rate
+
+
+def resolve(path, save_dir):
+    """Manifest filenames are relative to where the recorder ran, normally the parent of save_dir."""
+    if os.path.exists(path):
+        return path
+    return os.path.join(os.path.dirname(os.path.normpath(save_dir)), path)
+
+
+def file_hash(path, algorithm="sha1", chunk_size=1 << 20):
+    """Hex digest of a file's contents, read in chunks of `chunk_size` bytes."""
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def open_map(filename):
+    """A `WavMap` of a take: memory-mapped for WAV, decoded into memory for compressed takes."""
+    if codec_of(filename) == "wav":
+        return WavMap(filename)
+    pcm, rate = read(filename)
+    return WavMap.from_array(pcm, rate, filename=filename)
+
+
+def copy_path(filename, cache_dir):
+    return os.path.join(
+        cache_dir, os.path.splitext(os.path.basename(filename))[0] + ".wav"
+    )
+
+
+def cached_wav(filename, cache_dir):
+    """Path of an up to date WAV copy of a take in `cache_dir` (the take itself for WAV), None if it needs decoding."""
+    if codec_of(filename) == "wav":
+        return filename
+    path = copy_path(filename, cache_dir)
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(filename):
+        os.utime(path)
+        return path
+    return None
+
+
+def decode_to_wav(filename, cache_dir, keep=16):
+    """Path of a WAV copy of a compressed take, for players that only handle WAV; WAV takes are returned as is.
+
+    Copies live in `cache_dir`, and only the `keep` most recently decoded are kept.
+    """
+    path = cached_wav(filename, cache_dir)
+    if path is not None:
+        return path
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    path = copy_path(filename, cache_dir)
+    pcm, rate = read(filename)
+    write_wav(path + ".tmp", pcm.tobytes(), rate)
+    os.replace(path + ".tmp", path)
+    copies = sorted(
+        (entry.stat().st_mtime, entry.path)
+        for entry in os.scandir(cache_dir)
+        if entry.name.endswith(".wav")
+    )
+    for _, old_path in copies[:-keep]:
+        os.remove(old_path)
+    return path
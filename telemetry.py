@@ -0,0 +1,234 @@
+import bisect, json, logging, os, threading, time
+
+# Histogram bucket upper bounds in seconds: 10 us to ~60 s, each sqrt(2) times the last
+BUCKETS = tuple(1e-5 * 2 ** (i / 2.0) for i in range(46))
+
+
+class RollingHistogram(object):
+    """Latency histogram over fixed log-spaced buckets, with cumulative totals and a rolling recent window.
+
+    The cumulative counts never reset (what Prometheus expects); the rolling window keeps `slots` slots of
+    `slot_s` seconds each, so percentiles reflect roughly the last `slots * slot_s` seconds. Recording is a
+    bisect and a few increments under a lock.
+    """
+
+    def __init__(self, buckets=BUCKETS, slot_s=10, slots=6):
+        self.buckets = buckets
+        self.slot_s = slot_s
+        self.lock = threading.Lock()
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.slot_counts = [[0] * (len(buckets) + 1) for _ in range(slots)]
+        self.slot_epochs = [None] * slots
+
+    def observe(self, value, now=None):
+        bucket = bisect.bisect_left(self.buckets, value)
+        epoch = int((time.monotonic() if now is None else now) // self.slot_s)
+        slot = epoch % len(self.slot_epochs)
+        with self.lock:
+            self.counts[bucket] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+            if self.slot_epochs[slot] != epoch:
+                self.slot_epochs[slot] = epoch
+                self.slot_counts[slot] = [0] * len(self.counts)
+            self.slot_counts[slot][bucket] += 1
+
+    def recent(self, now=None):
+        """Bucket counts of the rolling window."""
+        epoch = int((time.monotonic() if now is None else now) // self.slot_s)
+        counts = [0] * len(self.counts)
+        with self.lock:
+            for slot_epoch, slot_counts in zip(self.slot_epochs, self.slot_counts):
+                if slot_epoch is not None and epoch - slot_epoch < len(
+                    self.slot_epochs
+                ):
+                    for i, count in enumerate(slot_counts):
+                        counts[i] += count
+        return counts
+
+    def percentile(self, counts, q):
+        """Upper bound of the bucket holding the `q` quantile of `counts` (the maximum past the last bucket), None if empty."""
+        total = sum(counts)
+        if not total:
+            return None
+        rank, seen = q * total, 0
+        for i, count in enumerate(counts):
+            seen += count
+            if seen >= rank:
+                return (
+                    min(self.buckets[i], self.max)
+                    if i < len(self.buckets)
+                    else self.max
+                )
+
+    def snapshot(self):
+        with self.lock:
+            counts, count, total, maximum = (
+                list(self.counts),
+                self.count,
+                self.sum,
+                self.max,
+            )
+        recent = self.recent()
+        return {
+            "count": count,
+            "sum": total,
+            "max": maximum,
+            "p50": self.percentile(counts, 0.5),
+            "p99": self.percentile(counts, 0.99),
+            "recent": {
+                "count": sum(recent),
+                "p50": self.percentile(recent, 0.5),
+                "p95": self.percentile(recent, 0.95),
+                "p99": self.percentile(recent, 0.99),
+            },
+        }
+
+
+class Stage(object):
+    """Context manager timing one stage into a `Telemetry` histogram."""
+
+    __slots__ = ("telemetry", "name", "start")
+
+    def __init__(self, telemetry, name):
+        self.telemetry = telemetry
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.telemetry.observe(self.name, time.perf_counter() - self.start)
+
+
+class Telemetry(object):
+    """Session metrics kept in process: latency histograms, counters and gauges, by name.
+
+    With a `path`, a background thread writes them out every `interval_s` seconds, and on `close()`, atomically
+    replacing the file: as Prometheus text exposition format (for node_exporter's textfile collector) if the path
+    ends in `.prom`, as JSON otherwise.
+    """
+
+    def __init__(self, path=None, interval_s=10, prefix="recorder"):
+        self.path = path
+        self.interval_s = interval_s
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.closed = threading.Event()
+        self.thread = None
+        if path:
+            self.thread = threading.Thread(
+                target=self._flush_loop, name="telemetry", daemon=True
+            )
+            self.thread.start()
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(name, RollingHistogram())
+        return histogram
+
+    def observe(self, name, seconds):
+        self.histogram(name).observe(seconds)
+
+    def stage(self, name):
+        """`with telemetry.stage("finish.read_audio"):` records how long the block took."""
+        return Stage(self, name)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        self.gauges[name] = value
+
+    def snapshot(self):
+        with self.lock:
+            histograms = dict(self.histograms)
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+        return {
+            "time": time.time(),
+            "histograms": {
+                name: histogram.snapshot()
+                for name, histogram in sorted(histograms.items())
+            },
+            "counters": counters,
+            "gauges": gauges,
+        }
+
+    def prometheus(self):
+        """The metrics in Prometheus text exposition format."""
+        lines = []
+        family = "%s_latency_seconds" % self.prefix
+        lines.append("# TYPE %s histogram" % family)
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+        for name, histogram in histograms:
+            with histogram.lock:
+                counts, count, total = (
+                    list(histogram.counts),
+                    histogram.count,
+                    histogram.sum,
+                )
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets, counts):
+                cumulative += bucket_count
+                lines.append(
+                    '%s_bucket{stage="%s",le="%.6g"} %d'
+                    % (family, name, bound, cumulative)
+                )
+            lines.append('%s_bucket{stage="%s",le="+Inf"} %d' % (family, name, count))
+            lines.append('%s_sum{stage="%s"} %.9g' % (family, name, total))
+            lines.append('%s_count{stage="%s"} %d' % (family, name, count))
+        for name, value in counters:
+            metric = "%s_%s_total" % (self.prefix, metric_name(name))
+            lines.append("# TYPE %s counter" % metric)
+            lines.append("%s %d" % (metric, value))
+        for name, value in gauges:
+            metric = "%s_%s" % (self.prefix, metric_name(name))
+            lines.append("# TYPE %s gauge" % metric)
+            lines.append("%s %.9g" % (metric, value))
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        if not self.path:
+            return
+        if self.path.endswith(".prom"):
+            text = self.prometheus()
+        else:
+            text = json.dumps(self.snapshot(), indent=1, sort_keys=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as file:
+            file.write(text)
+        os.replace(tmp_path, self.path)
+
+    def _flush_loop(self):
+        while not self.closed.wait(self.interval_s):
+            try:
+                self.flush()
+            except Exception as e:
+                logging.warning("could not write metrics to %s: %s", self.path, e)
+
+    def close(self):
+        self.closed.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.flush()
+
+
+def metric_name(name):
+    return "".join(c if c.isalnum() else "_" for c in name)
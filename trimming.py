@@ -0,0 +1,184 @@
+import collections
+
+import numpy as np
+import webrtcvad
+
+# For silence trimming
+vad_moving_average_width = 8
+int16_max = (2**15) - 1
+vad_window_length = 30
+sample_rate = 16000
+vad_max_silence_length = 6
+
+
+def to_pcm16(wav):
+    """Return `wav` as 16-bit mono PCM, converting float waveforms the same way as the original trimmer."""
+    if wav.dtype == np.int16:
+        return wav
+    return np.round(wav * int16_max).astype(np.int16)
+
+
+def detect_voice_windows(pcm, samples_per_window, vad=None, rate=sample_rate):
+    """Run webrtcvad over consecutive windows of an int16 array, returning one bool per full window."""
+    if vad is None:
+        vad = webrtcvad.Vad(mode=3)
+    n_windows = len(pcm) // samples_per_window
+    step = samples_per_window * 2
+    # One byte view over the PCM data, sliced per window without copying
+    buf = memoryview(np.ascontiguousarray(pcm[: n_windows * samples_per_window])).cast(
+        "B"
+    )
+    return np.fromiter(
+        (
+            vad.is_speech(buf[i : i + step], rate)
+            for i in range(0, n_windows * step, step)
+        ),
+        dtype=bool,
+        count=n_windows,
+    )
+
+
+def voiced_window_mask(voice_flags, width=None, max_silence=None):
+    """Smooth and dilate per-window VAD flags, staying at window resolution.
+
+    Equivalent to rounding a zero-padded moving average of `width` windows and then applying a binary dilation
+    with a structuring element of `max_silence + 1` windows.
+    """
+    if width is None:
+        width = vad_moving_average_width
+    if max_silence is None:
+        max_silence = vad_max_silence_length
+
+    flags = np.asarray(voice_flags, dtype=np.int32)
+    if len(flags) == 0:
+        return np.zeros(0, dtype=bool)
+
+    # np.round rounds half to even, so an average of exactly 0.5 stays unvoiced
+    mask = 2 * _centered_window_sum(flags, width) > width
+    # Dilate the voiced windows
+    return _centered_window_sum(mask, max_silence + 1) > 0
+
+
+def _centered_window_sum(values, size):
+    """Sum `values` over zero-padded windows `[i - (size - 1) // 2, i + size // 2]`, like `binary_dilation`'s footprint."""
+    n = len(values)
+    offset = (size - 1) // 2 + 1
+    csum = np.zeros(n + size, dtype=np.int32)
+    np.cumsum(values, out=csum[offset : offset + n])
+    csum[offset + n :] = csum[offset + n - 1]
+    return csum[size:] - csum[:-size]
+
+
+def voiced_spans(window_mask, samples_per_window):
+    """Return `(start, end)` sample offsets of each run of kept windows."""
+    edges = np.diff(np.concatenate(([0], window_mask.view(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1) * samples_per_window
+    ends = np.flatnonzero(edges == -1) * samples_per_window
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+def trim_spans(wav, rate=sample_rate, window_length=None, width=None, max_silence=None):
+    """Return the voiced `(start, end)` sample spans of `wav` (float or int16).
+
+    `window_length` (ms), `width` and `max_silence` (windows) default to the module's vad_* settings.
+    """
+    if window_length is None:
+        window_length = vad_window_length
+    samples_per_window = (window_length * rate) // 1000
+    pcm = to_pcm16(wav[: len(wav) - (len(wav) % samples_per_window)])
+    voice_flags = detect_voice_windows(pcm, samples_per_window, rate=rate)
+    return voiced_spans(
+        voiced_window_mask(voice_flags, width, max_silence), samples_per_window
+    )
+
+
+# Source: CorentinJ - Real Time Voice Cloning - Thanks for this one!
+def trim_long_silences(wav, **params):
+    """Remove long silences from `wav`, keeping voiced regions plus padding. `params` are passed to `trim_spans`."""
+    spans = trim_spans(wav, **params)
+    if not spans:
+        return wav[:0]
+    return np.concatenate([wav[start:end] for start, end in spans])
+
+
+class _CenteredWindow(object):
+    """Running sum over `[i - (size - 1) // 2, i + size // 2]` of a zero-padded stream, one value in, at most one out."""
+
+    def __init__(self, size):
+        self.size = size
+        self.lookahead = size // 2
+        self.window = collections.deque(maxlen=size)
+        self.total = 0
+        self.count = 0
+
+    def push(self, value):
+        """Add the next value; returns the sum centered `lookahead` values back, or None while still filling."""
+        if len(self.window) == self.size:
+            self.total -= self.window[0]
+        self.window.append(value)
+        self.total += value
+        self.count += 1
+        return self.total if self.count > self.lookahead else None
+
+
+class StreamingTrimmer(object):
+    """Trims long silences block by block while audio is being captured.
+
+    Applies the same moving average and dilation as `trim_long_silences`, but with one VAD decision per capture
+    block (window widths are rescaled from milliseconds). Only the few blocks still awaiting a decision are kept
+    in a bounded ring buffer; kept blocks are appended to the take, so `finish()` returns trimmed PCM ready to be
+    written once. The last `drop_last` blocks are held back and discarded, like `Recorder.read_audio(drop_last=...)`.
+    """
+
+    def __init__(self, block_ms=20, rate=sample_rate, drop_last=0, aggressiveness=3):
+        self.rate = rate
+        self.drop_last = drop_last
+        self.aggressiveness = aggressiveness
+        self.width = max(
+            1, round(vad_window_length * vad_moving_average_width / block_ms)
+        )
+        self.size = max(
+            1, round(vad_window_length * (vad_max_silence_length + 1) / block_ms)
+        )
+        self.reset()
+
+    def reset(self):
+        self.vad = webrtcvad.Vad(mode=self.aggressiveness)
+        self.average = _CenteredWindow(self.width)
+        self.dilation = _CenteredWindow(self.size)
+        self.held = collections.deque()
+        self.pending = collections.deque(
+            maxlen=self.average.lookahead + self.dilation.lookahead + 1
+        )
+        self.take = bytearray()
+
+    def feed(self, block):
+        """Add one captured block of int16 PCM; usable directly as an `audio.Audio` callback."""
+        self.held.append((block, self.vad.is_speech(block, self.rate)))
+        if len(self.held) > self.drop_last:
+            block, is_speech = self.held.popleft()
+            self.pending.append(block)
+            self._push_flag(int(is_speech))
+
+    def finish(self):
+        """Flush the pending blocks and return the trimmed take as a memoryview, resetting for the next one."""
+        # Zero padding past the end, as for the batch moving average and the dilation border
+        for _ in range(self.average.lookahead):
+            self._push_flag(0)
+        for _ in range(self.dilation.lookahead):
+            self._push_mask(0)
+        take = memoryview(self.take)
+        self.reset()
+        return take
+
+    def _push_flag(self, flag):
+        voiced = self.average.push(flag)
+        if voiced is not None:
+            self._push_mask(int(2 * voiced > self.width))
+
+    def _push_mask(self, mask):
+        keep = self.dilation.push(mask)
+        if keep is not None:
+            block = self.pending.popleft()
+            if keep:
+                self.take += block
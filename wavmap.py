@@ -0,0 +1,115 @@
+import os, struct
+
+import numpy as np
+
+# (format tag, bits per sample) -> sample dtype
+DTYPES = {
+    (1, 8): np.dtype("u1"),
+    (1, 16): np.dtype("<i2"),
+    (1, 32): np.dtype("<i4"),
+    (3, 32): np.dtype("<f4"),
+    (3, 64): np.dtype("<f8"),
+}
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class WavMap(object):
+    """Memory-mapped view of the PCM data chunk of a `.wav` file.
+
+    Nothing is read up front beyond the headers: indexing returns frames straight from the mapping, and `chunks()`
+    walks the file in fixed-size blocks, so memory stays flat however long the recording is.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as file:
+            file_size = os.fstat(file.fileno()).st_size
+            riff, _, wave = struct.unpack("<4sI4s", file.read(12))
+            if riff != b"RIFF" or wave != b"WAVE":
+                raise ValueError("%s is not a RIFF/WAVE file" % filename)
+            fmt = None
+            while True:
+                header = file.read(8)
+                if len(header) < 8:
+                    raise ValueError("%s has no data chunk" % filename)
+                chunk_id, size = struct.unpack("<4sI", header)
+                if chunk_id == b"data":
+                    offset = file.tell()
+                    break
+                if chunk_id == b"fmt ":
+                    fmt = file.read(size)
+                else:
+                    file.seek(size, 1)
+                # Chunks are word aligned
+                if size % 2:
+                    file.seek(1, 1)
+        if fmt is None:
+            raise ValueError("%s has no fmt chunk" % filename)
+
+        tag, self.channels, self.sample_rate, _, _, bits = struct.unpack(
+            "<HHIIHH", fmt[:16]
+        )
+        if tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+            tag = struct.unpack("<H", fmt[24:26])[0]
+        if (tag, bits) not in DTYPES:
+            raise ValueError(
+                "%s: unsupported format %s with %s bits" % (filename, tag, bits)
+            )
+        self.dtype = DTYPES[(tag, bits)]
+        frame_bytes = self.dtype.itemsize * self.channels
+        # Recorders that were interrupted leave a data size of 0 or past the end of the file
+        size = min(size, file_size - offset) if size else file_size - offset
+        self.num_frames = size // frame_bytes
+        if self.num_frames:
+            self.data = np.memmap(
+                filename,
+                dtype=self.dtype,
+                mode="r",
+                offset=offset,
+                shape=(self.num_frames, self.channels),
+            )
+        else:
+            # An empty mapping is an error, and there is nothing to map anyway
+            self.data = np.zeros((0, self.channels), dtype=self.dtype)
+
+    @classmethod
+    def from_array(cls, samples, sample_rate, filename=None):
+        """The same interface over samples already in memory, e.g. decoded from a compressed file."""
+        self = cls.__new__(cls)
+        self.filename = filename
+        self.data = samples.reshape(len(samples), -1)
+        self.sample_rate = sample_rate
+        self.channels = self.data.shape[1]
+        self.dtype = self.data.dtype
+        self.num_frames = len(samples)
+        return self
+
+    def __len__(self):
+        return self.num_frames
+
+    def __getitem__(self, key):
+        """Frames `key` (an index or slice), as a `(frames, channels)` view, or 1-D for mono files."""
+        frames = self.data[key]
+        return frames[..., 0] if self.channels == 1 else frames
+
+    @property
+    def duration(self):
+        return self.num_frames / float(self.sample_rate)
+
+    def chunks(self, chunk_frames, overlap=0):
+        """Yield `(start_frame, frames)` over the whole file, `chunk_frames` at a time, each overlapping the last by `overlap`."""
+        step = chunk_frames - overlap
+        for start in range(0, max(self.num_frames - overlap, 1), step):
+            yield start, self[start : start + chunk_frames]
+
+    def as_float(self, frames):
+        """Scale integer samples to [-1, 1) float32, as librosa does."""
+        if self.dtype.kind == "f":
+            return frames.astype(np.float32)
+        if self.dtype.kind == "u":
+            return (frames.astype(np.float32) - 128) / 128
+        return frames.astype(np.float32) / float(1 << (8 * self.dtype.itemsize - 1))
+
+    def close(self):
+        # np.memmap has no close(); dropping the last reference unmaps the file
+        self.data = None